@@ -0,0 +1,218 @@
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from os import getenv
+import json
+import logging
+import re
+import time
+
+import metrics
+from forecasts import (
+    TIMING_LOG,
+    bulk_executor,
+    fan_out,
+    fetch_city_forecast,
+    fetch_forecasts,
+    fetch_key_forecast,
+    forecast_line,
+    forecasts_body,
+    forecasts_error,
+    forecasts_etag,
+    forecasts_max_age,
+    iter_forecasts,
+)
+from payloads import (
+    compress,
+    encode_batch,
+    encoded_etag,
+    matched_etag,
+    negotiate_format,
+    wants_stream,
+)
+from upstream import UpstreamError
+
+# Максимальное число городов в одном запросе /get_data/batch
+BATCH_MAX_ITEMS = int(getenv("BATCH_MAX_ITEMS", "500"))
+# Location key AccuWeather - только цифры
+LOCATION_KEY = re.compile(r"[0-9]+")
+
+# Сервер JSON API. Сам по себе (python api.py) он не загружает Dash,
+# Plotly и pandas; app.py добавляет к нему интерфейс Dash
+server = Flask(__name__)
+
+timing_logger = logging.getLogger("weather.timing")
+
+
+@server.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+
+# Общее время запроса и, при TIMING_LOG=1, строка лога с этапами
+@server.after_request
+def finish_request_timing(response):
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else "other"
+    metrics.observe("request_seconds", elapsed, route=route)
+    if TIMING_LOG:
+        timing_logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "seconds": round(elapsed, 6),
+                    "stages": metrics.summarize(metrics.request_timings.get() or []),
+                },
+                ensure_ascii=False,
+            )
+        )
+    return response
+
+
+# Метрики в формате Prometheus
+@server.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@server.route("/get_data", methods=["GET"])
+def get_data():
+    city_names = request.args.get("cities")
+    if not city_names:
+        return jsonify({"error": 'Необходим параметр "cities"'}), 400
+    cities = city_names.split(",")
+
+    # Каждый город отправляется отдельной строкой, как только готов его прогноз.
+    # Потоковый режим: ?stream=1 или Accept: application/x-ndjson
+    if wants_stream(request.args.get("stream"), request.headers.get("Accept")):
+        lines = (
+            forecast_line(index, cities[index], future)
+            for index, future in iter_forecasts(cities)
+        )
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    try:
+        results = fetch_forecasts(cities)
+    except UpstreamError as error:
+        return jsonify({"error": f"Сервис погоды недоступен: {error}"}), 503
+
+    error = forecasts_error(cities, results)
+    if error:
+        message, status = error
+        return jsonify({"error": message}), status
+
+    # Если у клиента уже есть ответ с такими же прогнозами, тело не
+    # отправляется. If-None-Match сравнивается слабым сравнением
+    etag = forecasts_etag(cities, results)
+    matched = matched_etag(etag, request.headers.get("If-None-Match"))
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        response = compress_response(jsonify(forecasts_body(cities, results)))
+        encoding = response.headers.get("Content-Encoding")
+        response.set_etag(encoded_etag(etag, encoding))
+    response.cache_control.public = True
+    response.cache_control.max_age = forecasts_max_age(results)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# Сжатие ответа по Accept-Encoding
+def compress_response(response):
+    content, encoding = compress(response.get_data(), request.accept_encodings)
+    if encoding:
+        response.set_data(content)
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# Прогноз для одного элемента пакета; ошибка AccuWeather возвращается
+# вместо результата, чтобы не терять прогнозы остальных городов
+def fetch_batch_item(fetch, item):
+    try:
+        return fetch(item)
+    except UpstreamError as error:
+        return error
+
+
+# Пакетный запрос прогнозов: {"cities": [...]} или {"keys": [...]}.
+# Ответ колоночный: для каждого города число строк в "rows", значения
+# полей по всем городам подряд в "columns". Формат выбирается по Accept
+# (JSON, MessagePack, Arrow), ответ сжимается по Accept-Encoding
+@server.route("/get_data/batch", methods=["POST"])
+def get_data_batch():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        body = {}
+    if body.get("keys"):
+        items, fetch = body["keys"], fetch_key_forecast
+    else:
+        items, fetch = body.get("cities"), fetch_city_forecast
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": 'Необходим список "cities" или "keys"'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return (
+            jsonify({"error": f"Можно запросить не более {BATCH_MAX_ITEMS} городов"}),
+            400,
+        )
+    # Location key подставляется в путь запроса к AccuWeather
+    if fetch is fetch_key_forecast:
+        items = [str(item) for item in items]
+        for item in items:
+            if not LOCATION_KEY.fullmatch(item):
+                return jsonify({"error": f"Некорректный location key: {item}"}), 400
+    else:
+        for item in items:
+            if not isinstance(item, str) or not item.strip():
+                return jsonify({"error": f"Некорректное название города: {item}"}), 400
+
+    results = fan_out(
+        lambda item: fetch_batch_item(fetch, item), items, executor=bulk_executor
+    )
+
+    forecasts = []
+    keys = []
+    errors = []
+    for index, (item, result) in enumerate(zip(items, results)):
+        if isinstance(result, UpstreamError):
+            error = f"Сервис погоды недоступен: {result}"
+            errors.append({"index": index, "name": item, "error": error, "status": 503})
+            continue
+        location, data = result
+        if not location:
+            error = f"Не удалось найти данные для города: {item}"
+            errors.append({"index": index, "name": item, "error": error, "status": 400})
+        elif not data:
+            error = f"Не удалось получить данные о погоде для города: {item}"
+            errors.append({"index": index, "name": item, "error": error, "status": 404})
+        else:
+            forecasts.append((item, data))
+            keys.append(location.key)
+
+    # DataFrame-зависимости загружаются только при первом пакетном запросе
+    from ingest import FORECAST_FIELDS, column_values, date_values, forecasts_frame
+
+    frame = forecasts_frame(forecasts)
+    payload = {
+        "cities": [item for item, _ in forecasts],
+        "keys": keys,
+        "rows": [len(data) for _, data in forecasts],
+        "columns": {
+            "Date": date_values(frame),
+            **{column: column_values(frame[column]) for column in FORECAST_FIELDS},
+        },
+        "errors": errors,
+    }
+    mimetype = negotiate_format(request.accept_mimetypes)
+    response = Response(encode_batch(payload, frame, mimetype), mimetype=mimetype)
+    response.vary.add("Accept")
+    return compress_response(response)
+
+
+if __name__ == "__main__":
+    server.run(
+        host=getenv("API_HOST", "127.0.0.1"), port=int(getenv("API_PORT", "8050"))
+    )
@@ -8,69 +8,124 @@ from dash import (
     MATCH,
     ALL,
     ctx,
+    ClientsideFunction,
+    Patch,
 )
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
-import requests
-import pandas as pd
 import dash_bootstrap_components as dbc
 from dash_bootstrap_templates import load_figure_template
-from flask import Flask, request, jsonify
 from os import getenv
+import json
+import threading
+import uuid
 from urllib.parse import urlparse, parse_qs
 
+from api import server
+from ingest import column_values, forecasts_frame
+from cache import LRUCache, SizedLRUCache, make_cache
+from forecasts import (
+    CACHE_BACKEND,
+    CACHE_PATH,
+    CACHE_SYNC_INTERVAL,
+    fetch_forecasts,
+    forecast_version,
+    prepare_forecast_data,
+)
+import metrics
+from locations import Location
+from route_weather import ROUTE_SAMPLE_SPACING_KM, route_sampler
+from upstream import UpstreamError
+
+# Переключение параметра и числа дней на графике без запросов к серверу
+CLIENTSIDE_GRAPHS = getenv("CLIENTSIDE_GRAPHS", "0") == "1"
+
 # Настройка шаблонов Bootstrap
 load_figure_template(["minty", "minty_dark"])
 
-API_KEY = getenv("API_KEY")
-
-server = Flask(__name__)
 
 app = Dash(__name__, server=server, external_stylesheets=[dbc.themes.MINTY])
 
-df = pd.DataFrame()
+ROUTE_STORE_SIZE = int(getenv("ROUTE_STORE_SIZE", "1000"))
+ROUTE_STORE_TTL = int(getenv("ROUTE_STORE_TTL", "3600"))
+
+# Построенные маршруты: id маршрута -> прогнозы городов (пары город,
+# DailyForecasts) и список Location. У каждого пользователя свой маршрут,
+# поэтому данные не перезаписываются
+route_store = make_cache(
+    CACHE_BACKEND,
+    LRUCache(maxsize=ROUTE_STORE_SIZE, ttl=ROUTE_STORE_TTL),
+    CACHE_PATH,
+    table="routes",
+    ttl=ROUTE_STORE_TTL,
+    max_entries=ROUTE_STORE_SIZE * 10,
+    sync_interval=CACHE_SYNC_INTERVAL,
+)
+# Маршруты с уже построенными DataFrame, в памяти процесса
+route_frames = LRUCache(maxsize=ROUTE_STORE_SIZE, ttl=ROUTE_STORE_TTL)
+
+
+# Размер фигуры в кэше - длина её JSON
+def figure_size(figure):
+    return len(json.dumps(figure, separators=(",", ":")))
+
+
+# Готовые фигуры в виде словарей, которые Dash отправляет как есть:
+# графики по (версия прогноза, параметр, дни), карты по списку городов
+# маршрута. При попадании фигура не декодируется и не собирается заново
+figure_cache = make_cache(
+    CACHE_BACKEND,
+    SizedLRUCache(
+        max_bytes=int(getenv("FIGURE_CACHE_BYTES", str(64 * 1024 * 1024))),
+        max_item_bytes=int(getenv("FIGURE_CACHE_ITEM_BYTES", str(1024 * 1024))),
+        sizeof=figure_size,
+    ),
+    CACHE_PATH,
+    table="figures",
+    max_entries=int(getenv("FIGURE_CACHE_MAX_ENTRIES", "10000")),
+    sync_interval=CACHE_SYNC_INTERVAL,
+)
 
 
-# Функция для получения location key
-def get_location_key(city_name):
-    url = f"http://dataservice.accuweather.com/locations/v1/cities/search?apikey={API_KEY}&q={city_name}&language=ru-RU"
-    response = requests.get(url)
-    if response.status_code == 200 and response.json():
-        return response.json()[0]["Key"]
-    return None
+figure_stats = {"hits": 0, "misses": 0}
+figure_stats_lock = threading.Lock()
 
 
-# Функция для получения координат города
-def get_city_coordinates(city_name):
-    location_key = get_location_key(city_name)
-    if location_key:
-        url = f"http://dataservice.accuweather.com/locations/v1/{location_key}?apikey={API_KEY}"
-        response = requests.get(url)
-        if response.status_code == 200 and response.json():
-            coords = response.json().get("GeoPosition", {})
-            return coords.get("Latitude"), coords.get("Longitude")
-    return None, None
+# Фигура из кэша или построенная build() и сохранённая в кэш.
+# Фигура Plotly один раз переводится в словарь из обычных типов JSON
+def cached_figure(key, build):
+    figure = figure_cache.get(key)
+    with figure_stats_lock:
+        figure_stats["misses" if figure is None else "hits"] += 1
+    if figure is None:
+        figure = json.loads(build().to_json())
+        figure_cache.set(key, figure)
+    return figure
 
 
-# Функция для получения данных прогноза погоды на 5 дней
-def get_forecast_data(location_key):
-    url = f"http://dataservice.accuweather.com/forecasts/v1/daily/5day/{location_key}?apikey={API_KEY}&metric=true&details=true"
-    response = requests.get(url)
-    if response.status_code == 200 and response.json():
-        return response.json()["DailyForecasts"]
-    return None
+GRAPH_LABELS = {
+    "Temperature": "Температура (°C)",
+    "Wind Speed": "Скорость ветра (м/c)",
+    "Precipitation Probability": "Вероятность осадков (%)",
+}
 
 
 # Создание графика
+@metrics.timed("create_graph")
 def create_graph(data, param, days=3):
-    labels = {
-        "Temperature": "Температура (°C)",
-        "Wind Speed": "Скорость ветра (м/c)",
-        "Precipitation Probability": "Вероятность осадков (%)",
-    }
+    version = data.attrs.get("version")
+    if version is None:
+        return build_graph(data, param, days)
+    return cached_figure(
+        ("graph", version, param, days), lambda: build_graph(data, param, days)
+    )
+
+
+def build_graph(data, param, days):
     fig = go.Figure(
         data=go.Scatter(
-            x=data.head(days)["Date"],
-            y=data.head(days)[param],
+            x=column_values(data.head(days)["Date"]),
+            y=column_values(data.head(days)[param]),
             mode="lines+markers",
             name=param,
         )
@@ -79,69 +134,69 @@ def create_graph(data, param, days=3):
         title="Прогноз погоды",
         template="minty_dark",
         xaxis_title="Дата",
-        yaxis_title=labels[param],
+        yaxis_title=GRAPH_LABELS[param],
     )
     return fig
 
 
-def prepare_forecast_data(data):
-    forecast_data = []
-    for day in data:
-        forecast = {
-            "Date": day["Date"],
-            "Temperature": day["Temperature"]["Maximum"]["Value"],
-            "Wind Speed": day["Day"]["Wind"]["Speed"]["Value"],
-            "Precipitation Probability": day["Day"]["PrecipitationProbability"],
-        }
-        forecast_data.append(forecast)
-    return forecast_data
-
+# Прогнозы маршрута: один DataFrame на все города и срезы по городам.
+# forecasts - список пар (город, DailyForecasts)
+@metrics.timed("create_route_frames")
+def create_route_frames(forecasts):
+    frame = forecasts_frame(forecasts)
+    frames = {}
+    start = 0
+    for city, data in forecasts:
+        city_df = frame.iloc[start : start + len(data)]
+        city_df.attrs = {"version": forecast_version(data)}
+        frames[city] = city_df
+        start += len(data)
+    return frames
+
+
+metrics.register_stats("figure", figure_stats)
+
+
+# Версии прогнозов точек маршрута для ключей кэша карты и профиля
+def samples_key(samples):
+    versions = {}
+    for sample in samples:
+        key = sample["location"].key
+        if key not in versions:
+            versions[key] = forecast_version(sample["forecast"])
+    return tuple(
+        (sample["location"].key, versions[sample["location"].key]) for sample in samples
+    )
 
-# Создание DataFrame
-def create_df(data):
-    return pd.DataFrame(prepare_forecast_data(data))
 
+# Погода в точке маршрута на сегодня и подпись для неё
+def sample_weather(sample):
+    weather = prepare_forecast_data(sample["forecast"][:1])[0]
+    text = (
+        f"{sample['location'].name}: {weather['Temperature']} °C, "
+        f"ветер {weather['Wind Speed']} км/ч, "
+        f"осадки {weather['Precipitation Probability']}%"
+    )
+    return weather, text
 
-@server.route("/get_data", methods=["GET"])
-def get_data():
-    city_names = request.args.get("cities")
-    if not city_names:
-        return jsonify({"error": 'Необходим параметр "cities"'}), 400
-    print(city_names)
-    cities = city_names.split(",")
-    cities_data = []
 
-    for city in cities:
-        location_key = get_location_key(city)
-        if not location_key:
-            return (
-                jsonify({"error": f"Не удалось найти данные для города: {city}"}),
-                400,
-            )
-        data = get_forecast_data(location_key)
-        if data:
-            forecast_data = prepare_forecast_data(data)
-            cities_data.append({"name": city, "forecast": forecast_data})
-        else:
-            return (
-                jsonify(
-                    {"error": f"Не удалось получить данные о погоде для города: {city}"}
-                ),
-                404,
-            )
-    return jsonify(cities_data), 200
+# Функция для создания карты по списку Location и точкам погоды вдоль маршрута
+@metrics.timed("create_map")
+def create_map(cities, samples=()):
+    return cached_figure(
+        ("map", tuple(cities), samples_key(samples)),
+        lambda: build_map(cities, samples),
+    )
 
 
-# Функция для создания карты
-def create_map(cities):
+def build_map(cities, samples=()):
     locations = []
     city_names = []
 
     for city in cities:
-        lat, lon = get_city_coordinates(city)
-        if lat is not None and lon is not None:
-            locations.append([lat, lon])
-            city_names.append(city)
+        if city.lat is not None and city.lon is not None:
+            locations.append([city.lat, city.lon])
+            city_names.append(city.name)
 
     if not locations:
         return go.Figure()
@@ -163,6 +218,25 @@ def create_map(cities):
         )
     )
 
+    # Точки вдоль маршрута, окрашенные по температуре
+    if samples:
+        weather = [sample_weather(sample) for sample in samples]
+        fig.add_trace(
+            go.Scattermapbox(
+                lat=[sample["lat"] for sample in samples],
+                lon=[sample["lon"] for sample in samples],
+                mode="markers",
+                marker={
+                    "size": 8,
+                    "color": [values["Temperature"] for values, _ in weather],
+                    "colorscale": "RdBu_r",
+                    "colorbar": {"title": "°C"},
+                },
+                hovertext=[text for _, text in weather],
+                hoverinfo="text",
+            )
+        )
+
     fig.update_layout(
         mapbox={
             "style": "open-street-map",
@@ -177,6 +251,54 @@ def create_map(cities):
     return fig
 
 
+# Погода на сегодня по расстоянию от начала маршрута
+@metrics.timed("create_profile")
+def create_profile(samples):
+    return cached_figure(
+        ("profile", samples_key(samples)), lambda: build_profile(samples)
+    )
+
+
+def build_profile(samples):
+    if not samples:
+        return go.Figure()
+    distances = [round(sample["distance"]) for sample in samples]
+    weather = [sample_weather(sample) for sample in samples]
+    fig = go.Figure()
+    fig.add_trace(
+        go.Bar(
+            x=distances,
+            y=[values["Precipitation Probability"] for values, _ in weather],
+            name=GRAPH_LABELS["Precipitation Probability"],
+            yaxis="y2",
+            opacity=0.4,
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=distances,
+            y=[values["Temperature"] for values, _ in weather],
+            mode="lines+markers",
+            name=GRAPH_LABELS["Temperature"],
+            hovertext=[text for _, text in weather],
+        )
+    )
+    fig.update_layout(
+        title="Погода вдоль маршрута",
+        template="minty_dark",
+        xaxis_title="Расстояние от начала маршрута (км)",
+        yaxis_title=GRAPH_LABELS["Temperature"],
+        yaxis2={
+            "title": GRAPH_LABELS["Precipitation Probability"],
+            "overlaying": "y",
+            "side": "right",
+            "range": [0, 100],
+        },
+        legend={"orientation": "h"},
+    )
+    return fig
+
+
 app.layout = dbc.Container(
     [
         dcc.Location(id="url", refresh=False),
@@ -277,6 +399,7 @@ app.layout = dbc.Container(
     Input("url", "search"),
     prevent_initial_call=True,
 )
+@metrics.timed("callback.get_weather_from_link")
 def get_weather_from_link(search):
     if not search:
         return "", "", 0
@@ -294,6 +417,7 @@ def get_weather_from_link(search):
     State("intermediate-cities-container", "children"),
     prevent_initial_call=True,
 )
+@metrics.timed("callback.update_intermediate_city")
 def update_intermediate_city(add_clicks, remove_clicks, children):
     triggered_id = ctx.triggered_id
 
@@ -341,6 +465,84 @@ def update_intermediate_city(add_clicks, remove_clicks, children):
     return children
 
 
+# Карточка города: переключатели и место под график, который
+# загружается отдельным запросом (load_graph)
+def create_city_card(city, city_df, route_id):
+    graph_controls = html.Div(
+        [
+            dcc.RadioItems(
+                id={
+                    "type": "forecast-type-radio",
+                    "index": city,
+                    "route": route_id,
+                },
+                options=[
+                    {"label": "Температура", "value": "Temperature"},
+                    {"label": "Скорость ветра", "value": "Wind Speed"},
+                    {
+                        "label": "Вероятность осадков",
+                        "value": "Precipitation Probability",
+                    },
+                ],
+                value="Temperature",
+                inline=True,
+                style={"display": "flex", "gap": "20px"},
+            ),
+            dcc.Slider(
+                1,
+                5,
+                2,
+                value=3,
+                id={
+                    "type": "forecast-days-slider",
+                    "index": city,
+                    "route": route_id,
+                },
+            ),
+        ]
+    )
+
+    graph = dcc.Loading(
+        dcc.Graph(
+            id={
+                "type": "forecast-graph",
+                "index": city,
+                "route": route_id,
+            }
+        )
+    )
+
+    card = [
+        html.H4(f"Город: {city}", className="text-center"),
+        graph_controls,
+        graph,
+    ]
+    # Данные графика один раз отправляются в браузер,
+    # дальше он перестраивается в assets/main.js
+    if CLIENTSIDE_GRAPHS:
+        columns = ["Date", *GRAPH_LABELS]
+        card.append(
+            dcc.Store(
+                id={
+                    "type": "forecast-data",
+                    "index": city,
+                    "route": route_id,
+                },
+                data={
+                    "columns": {
+                        column: column_values(city_df[column]) for column in columns
+                    },
+                    "labels": GRAPH_LABELS,
+                },
+            )
+        )
+
+    return dbc.Card(
+        dbc.CardBody(card),
+        className="mb-4",
+    )
+
+
 @app.callback(
     Output("weather-graphs", "children"),
     Output("error-alert", "is_open"),
@@ -351,83 +553,59 @@ def update_intermediate_city(add_clicks, remove_clicks, children):
     State({"type": "intermediate-city", "index": ALL}, "value"),
     prevent_initial_call=True,
 )
+@metrics.timed("callback.get_weather")
 def get_weather(n_clicks, start_city, end_city, intermediate_cities):
     if n_clicks > 0:
 
-        global df
         if not start_city or not end_city:
             return "", True, "Укажите начальный и конечный города."
 
         cities = [start_city] + (intermediate_cities or []) + [end_city]
         cities = [x for x in cities if x is not None]
 
-        all_data = []
-        graphs = []
-
-        for city in cities:
-            location_key = get_location_key(city)
-            if not location_key:
-                return "", True, f"Не удалось найти данные для города {city}."
-
-            forecast = get_forecast_data(location_key)
-            if forecast:
-                city_df = create_df(forecast)
-                city_df["City"] = city
-                all_data.append(city_df)
-
-                graph_controls = html.Div(
-                    [
-                        dcc.RadioItems(
-                            id={"type": "forecast-type-radio", "index": city},
-                            options=[
-                                {"label": "Температура", "value": "Temperature"},
-                                {"label": "Скорость ветра", "value": "Wind Speed"},
-                                {
-                                    "label": "Вероятность осадков",
-                                    "value": "Precipitation Probability",
-                                },
-                            ],
-                            value="Temperature",
-                            inline=True,
-                            style={"display": "flex", "gap": "20px"},
-                        ),
-                        dcc.Slider(
-                            1,
-                            5,
-                            2,
-                            value=3,
-                            id={"type": "forecast-days-slider", "index": city},
-                        ),
-                    ]
-                )
+        route_id = uuid.uuid4().hex
+        forecasts = []
+        locations = []
 
-                graph = dcc.Graph(
-                    id={"type": "forecast-graph", "index": city},
-                    figure=create_graph(city_df, "Temperature", 3),
-                )
+        try:
+            results = fetch_forecasts(cities)
+        except UpstreamError as error:
+            return "", True, f"Сервис погоды недоступен: {error}"
 
-                graphs.append(
-                    dbc.Card(
-                        dbc.CardBody(
-                            [
-                                html.H4(f"Город: {city}", className="text-center"),
-                                graph_controls,
-                                graph,
-                            ]
-                        ),
-                        className="mb-4",
-                    )
-                )
-            else:
+        for city, (location, forecast) in zip(cities, results):
+            if not location:
+                return "", True, f"Не удалось найти данные для города {city}."
+            if not forecast:
                 return "", True, f"Не удалось загрузить прогноз для города {city}."
+            locations.append(location)
+            forecasts.append((city, forecast))
+
+        route_data = create_route_frames(forecasts)
+        graphs = [
+            create_city_card(city, city_df, route_id)
+            for city, city_df in route_data.items()
+        ]
 
-        df = pd.concat(all_data, ignore_index=True)
+        route_store.set(route_id, {"forecasts": forecasts, "locations": locations})
+        route_frames.set(route_id, {"forecasts": route_data, "locations": locations})
         graphs.append(
             dbc.Card(
                 dbc.CardBody(
                     [
                         html.H4(f"Маршрут между городами", className="text-center"),
-                        dcc.Graph(figure=create_map(cities)),
+                        dcc.Loading(
+                            dcc.Graph(id={"type": "route-map", "route": route_id})
+                        ),
+                        dcc.Loading(
+                            dcc.Graph(
+                                id={"type": "route-profile", "route": route_id},
+                                style=(
+                                    None
+                                    if ROUTE_SAMPLE_SPACING_KM > 0
+                                    else {"display": "none"}
+                                ),
+                            )
+                        ),
                     ]
                 ),
                 className="mb-4",
@@ -439,18 +617,94 @@ def get_weather(n_clicks, start_city, end_city, intermediate_cities):
         return "", False, ""
 
 
+# Данные маршрута с DataFrame по городам. Если маршрут построен
+# в другом процессе сервера, DataFrame собираются из общего кэша
+def get_route(route_id):
+    route = route_frames.get(route_id)
+    if route is None:
+        stored = route_store.get(route_id)
+        if stored is None:
+            return None
+        route = {
+            "forecasts": create_route_frames(
+                [(city, data) for city, data in stored["forecasts"]]
+            ),
+            "locations": [Location(*location) for location in stored["locations"]],
+        }
+        route_frames.set(route_id, route)
+    return route
+
+
+# Первая загрузка графика города: срабатывает, когда карточка
+# появляется на странице; графики всех городов грузятся параллельно
 @app.callback(
-    Output({"type": "forecast-graph", "index": MATCH}, "figure"),
-    [
-        Input({"type": "forecast-type-radio", "index": MATCH}, "value"),
-        Input({"type": "forecast-days-slider", "index": MATCH}, "value"),
-    ],
-    prevent_initial_call=True,
+    Output({"type": "forecast-graph", "index": MATCH, "route": MATCH}, "figure"),
+    Input({"type": "forecast-graph", "index": MATCH, "route": MATCH}, "id"),
+    State({"type": "forecast-type-radio", "index": MATCH, "route": MATCH}, "value"),
+    State({"type": "forecast-days-slider", "index": MATCH, "route": MATCH}, "value"),
+)
+@metrics.timed("callback.load_graph")
+def load_graph(graph_id, params, days):
+    route_data = get_route(graph_id["route"])
+    if route_data is None:
+        raise PreventUpdate
+    return create_graph(route_data["forecasts"][graph_id["index"]], params, days)
+
+
+# Карта и погода вдоль маршрута. Точки привязываются к городам, которые
+# уже есть в кэше, поэтому поиск городов в AccuWeather не нужен
+@app.callback(
+    Output({"type": "route-map", "route": MATCH}, "figure"),
+    Output({"type": "route-profile", "route": MATCH}, "figure"),
+    Input({"type": "route-map", "route": MATCH}, "id"),
 )
+@metrics.timed("callback.load_map")
+def load_map(map_id):
+    route_data = get_route(map_id["route"])
+    if route_data is None:
+        raise PreventUpdate
+    samples = route_sampler.sample(route_data["locations"])
+    return create_map(route_data["locations"], samples), create_profile(samples)
+
+
+# Обновление графика: отправляются только изменённые данные серии
+# и подпись оси, а не вся фигура
+@metrics.timed("callback.update_graph")
 def update_graph(params, days):
-    city = ctx.triggered_id["index"]
-    city_df = df[df["City"] == city]
-    return create_graph(city_df, params, days)
+    graph_id = ctx.triggered_id
+    route_data = get_route(graph_id["route"])
+    if route_data is None:
+        raise PreventUpdate
+    data = route_data["forecasts"][graph_id["index"]].head(days)
+    figure = Patch()
+    figure["data"][0]["x"] = column_values(data["Date"])
+    figure["data"][0]["y"] = column_values(data[params])
+    figure["data"][0]["name"] = params
+    figure["layout"]["yaxis"]["title"]["text"] = GRAPH_LABELS[params]
+    return figure
+
+
+graph_output = Output(
+    {"type": "forecast-graph", "index": MATCH, "route": MATCH},
+    "figure",
+    allow_duplicate=True,
+)
+graph_inputs = [
+    Input({"type": "forecast-type-radio", "index": MATCH, "route": MATCH}, "value"),
+    Input({"type": "forecast-days-slider", "index": MATCH, "route": MATCH}, "value"),
+]
+
+if CLIENTSIDE_GRAPHS:
+    app.clientside_callback(
+        ClientsideFunction(namespace="forecast", function_name="updateGraph"),
+        graph_output,
+        *graph_inputs,
+        State({"type": "forecast-data", "index": MATCH, "route": MATCH}, "data"),
+        State({"type": "forecast-graph", "index": MATCH, "route": MATCH}, "figure"),
+        prevent_initial_call=True,
+    )
+else:
+    app.callback(graph_output, *graph_inputs, prevent_initial_call=True)(update_graph)
 
 
 if __name__ == "__main__":
@@ -1 +1,28 @@
-document.documentElement.setAttribute('data-bs-theme', 'dark')
\ No newline at end of file
+document.documentElement.setAttribute('data-bs-theme', 'dark')
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    forecast: {
+        // Перестроение графика прогноза в браузере (CLIENTSIDE_GRAPHS=1):
+        // оформление берётся из текущей фигуры, меняются только данные
+        updateGraph: function (param, days, data, figure) {
+            if (!data || !figure) {
+                return window.dash_clientside.no_update
+            }
+            const columns = data.columns
+            const layout = Object.assign({}, figure.layout)
+            layout.yaxis = Object.assign({}, layout.yaxis, {
+                title: {text: data.labels[param]},
+            })
+            return {
+                data: [{
+                    type: 'scatter',
+                    x: columns['Date'].slice(0, days),
+                    y: columns[param].slice(0, days),
+                    mode: 'lines+markers',
+                    name: param,
+                }],
+                layout: layout,
+            }
+        },
+    },
+})
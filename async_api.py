@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+from os import getenv
+
+from aiohttp import web
+
+import metrics
+from forecasts import (
+    ACCUWEATHER_URL,
+    API_KEY,
+    LANGUAGE,
+    SNAPSHOT_MODE,
+    TIMING_LOG,
+    UPSTREAM_SETTINGS,
+    forecast_cache as sync_forecast_cache,
+    forecast_line,
+    forecasts_body,
+    forecasts_error,
+    forecasts_etag,
+    forecasts_max_age,
+    location_cache,
+    parse_forecast,
+    parse_location,
+    prefetcher,
+)
+from cache import AsyncRefreshingCache
+from locations import AsyncLocationResolver, normalize_city_name
+from payloads import compress, encoded_etag, matched_etag, wants_stream
+from singleflight import AsyncSingleFlight
+from upstream import AsyncUpstreamClient, UpstreamError
+
+ASYNC_API_HOST = getenv("ASYNC_API_HOST", "127.0.0.1")
+ASYNC_API_PORT = int(getenv("ASYNC_API_PORT", "8060"))
+# Число процессов, каждый со своим циклом событий (обычно по числу ядер)
+ASYNC_API_WORKERS = int(getenv("ASYNC_API_WORKERS", "1"))
+
+# Асинхронный клиент AccuWeather с тем же лимитом запросов, что и у
+# обычного; кэши городов и прогнозов общие с forecasts.py
+upstream = AsyncUpstreamClient(ACCUWEATHER_URL, API_KEY, **UPSTREAM_SETTINGS)
+if SNAPSHOT_MODE != "off":
+    from forecasts import snapshot_store
+    from snapshots import AsyncSnapshotClient
+
+    upstream = AsyncSnapshotClient(upstream, snapshot_store, SNAPSHOT_MODE)
+    metrics.register_stats(
+        "async", upstream.stats, metric="snapshot_events_total", label="client"
+    )
+
+upstream_calls = AsyncSingleFlight()
+
+
+async def request_location(city_name):
+    response = await upstream.get(
+        "/locations/v1/cities/search", {"q": city_name, "language": LANGUAGE}
+    )
+    return parse_location(response, city_name)
+
+
+async def search_location(city_name):
+    key = ("location", normalize_city_name(city_name, LANGUAGE))
+    return await upstream_calls.do(key, request_location, city_name)
+
+
+location_resolver = AsyncLocationResolver(search_location, location_cache, LANGUAGE)
+
+
+async def request_forecast_data(location_key):
+    response = await upstream.get(
+        f"/forecasts/v1/daily/5day/{location_key}",
+        {"metric": "true", "details": "true"},
+    )
+    return parse_forecast(response)
+
+
+async def fetch_forecast_data(location_key):
+    return await upstream_calls.do(
+        ("forecast", location_key), request_forecast_data, location_key
+    )
+
+
+forecast_cache = AsyncRefreshingCache(
+    fetch_forecast_data,
+    ttl=sync_forecast_cache.ttl,
+    grace=sync_forecast_cache.grace,
+    entries=sync_forecast_cache.entries,
+)
+
+metrics.register_stats("async_location", location_resolver.stats)
+metrics.register_stats("async_forecast", forecast_cache.stats)
+
+timing_logger = logging.getLogger("weather.timing")
+
+
+async def fetch_city_forecast(city_name):
+    with metrics.timer("resolve_location"):
+        location = await location_resolver.resolve(city_name)
+    if not location:
+        return None, None
+    with metrics.timer("get_forecast_data"):
+        data = await forecast_cache.get(location.key)
+    if data:
+        prefetcher.record(location.key)
+    return location, data
+
+
+# JSON в том же виде, что и у jsonify во Flask
+def dumps(data):
+    return json.dumps(data, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+def error_response(message, status):
+    return web.json_response({"error": message}, status=status, dumps=dumps)
+
+
+def accept_encodings(request):
+    header = request.headers.get("Accept-Encoding", "")
+    return {item.split(";")[0].strip() for item in header.split(",")}
+
+
+# Тот же ответ, что и у /get_data в api.py, но ожидание AccuWeather
+# не занимает поток: все запросы обслуживаются одним циклом событий
+async def get_data(request):
+    city_names = request.query.get("cities")
+    if not city_names:
+        return error_response('Необходим параметр "cities"', 400)
+    cities = city_names.split(",")
+    tasks = [asyncio.ensure_future(fetch_city_forecast(city)) for city in cities]
+
+    if wants_stream(request.query.get("stream"), request.headers.get("Accept")):
+        return await stream_forecasts(request, cities, tasks)
+
+    try:
+        results = await asyncio.gather(*tasks)
+    except UpstreamError as error:
+        await cancel_tasks(tasks)
+        return error_response(f"Сервис погоды недоступен: {error}", 503)
+
+    error = forecasts_error(cities, results)
+    if error:
+        return error_response(*error)
+
+    # Слабое сравнение If-None-Match, как и в api.py
+    etag = forecasts_etag(cities, results)
+    matched = matched_etag(etag, request.headers.get("If-None-Match"))
+    if matched:
+        response = web.Response(status=304)
+        response.etag = matched
+    else:
+        body = dumps(forecasts_body(cities, results)).encode()
+        body, encoding = compress(body, accept_encodings(request))
+        response = web.Response(body=body, content_type="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.etag = encoded_etag(etag, encoding)
+    max_age = await asyncio.to_thread(forecasts_max_age, results)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+# Каждый город отправляется отдельной строкой, как только готов его прогноз
+async def stream_forecasts(request, cities, tasks):
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    pending = {task: index for index, task in enumerate(tasks)}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                line = forecast_line(index, cities[index], task)
+                await response.write(line.encode())
+    finally:
+        # Клиент отключился: оставшиеся города больше не нужны
+        await cancel_tasks(pending)
+    await response.write_eof()
+    return response
+
+
+# Отмена задач и получение их результатов, чтобы ошибки задач,
+# завершившихся после первой ошибки, не попадали в лог как неполученные
+async def cancel_tasks(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def get_metrics(request):
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4"},
+    )
+
+
+# Общее время запроса и, при TIMING_LOG=1, строка лога с этапами
+@web.middleware
+async def request_timing(request, handler):
+    started = time.perf_counter()
+    timings = metrics.start_request()
+    response = await handler(request)
+    elapsed = time.perf_counter() - started
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource else "other"
+    metrics.observe("request_seconds", elapsed, route=route)
+    if TIMING_LOG:
+        timing_logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status,
+                    "seconds": round(elapsed, 6),
+                    "stages": metrics.summarize(timings),
+                },
+                ensure_ascii=False,
+            )
+        )
+    return response
+
+
+async def start_upstream(application):
+    await upstream.start()
+
+
+async def close_upstream(application):
+    await upstream.close()
+
+
+def make_app():
+    application = web.Application(middlewares=[request_timing])
+    application.router.add_get("/get_data", get_data)
+    application.router.add_get("/metrics", get_metrics)
+    application.on_startup.append(start_upstream)
+    application.on_cleanup.append(close_upstream)
+    return application
+
+
+def serve():
+    web.run_app(
+        make_app(),
+        host=ASYNC_API_HOST,
+        port=ASYNC_API_PORT,
+        reuse_port=ASYNC_API_WORKERS > 1,
+    )
+
+
+# Несколько процессов слушают один порт (SO_REUSEPORT), ядро
+# распределяет между ними входящие соединения
+def main():
+    if ASYNC_API_WORKERS <= 1:
+        serve()
+        return
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=serve, name=f"async-api-{number}")
+        for number in range(ASYNC_API_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from flask import Flask, abort, jsonify, request
+
+# Города, которые находит заглушка, с настоящими координатами.
+# Остальные названия тоже находятся, но с координатами из хеша названия
+CITIES = {
+    "москва": ("Москва", 55.7558, 37.6173),
+    "санкт-петербург": ("Санкт-Петербург", 59.9343, 30.3351),
+    "новосибирск": ("Новосибирск", 55.0084, 82.9357),
+    "екатеринбург": ("Екатеринбург", 56.8389, 60.6057),
+    "казань": ("Казань", 55.7961, 49.1064),
+    "нижний новгород": ("Нижний Новгород", 56.2965, 43.9361),
+    "челябинск": ("Челябинск", 55.1644, 61.4368),
+    "самара": ("Самара", 53.1959, 50.1002),
+    "омск": ("Омск", 54.9885, 73.3242),
+    "ростов-на-дону": ("Ростов-на-Дону", 47.2357, 39.7015),
+    "уфа": ("Уфа", 54.7388, 55.9721),
+    "красноярск": ("Красноярск", 56.0153, 92.8932),
+    "воронеж": ("Воронеж", 51.6720, 39.1843),
+    "пермь": ("Пермь", 58.0105, 56.2502),
+    "волгоград": ("Волгоград", 48.7080, 44.5133),
+    "тверь": ("Тверь", 56.8587, 35.9176),
+    "ярославль": ("Ярославль", 57.6261, 39.8845),
+    "владимир": ("Владимир", 56.1290, 40.4066),
+    "рязань": ("Рязань", 54.6269, 39.6916),
+    "тула": ("Тула", 54.1931, 37.6173),
+    "калуга": ("Калуга", 54.5293, 36.2754),
+    "смоленск": ("Смоленск", 54.7818, 32.0401),
+    "великий новгород": ("Великий Новгород", 58.5228, 31.2698),
+    "псков": ("Псков", 57.8136, 28.3496),
+    "сочи": ("Сочи", 43.5855, 39.7231),
+}
+
+ICONS = [
+    (1, "Солнечно"),
+    (3, "Переменная облачность"),
+    (7, "Облачно"),
+    (12, "Ливни"),
+    (18, "Дождь"),
+    (22, "Снег"),
+]
+
+server = Flask(__name__)
+
+config = {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0}
+calls = Counter()
+locations = {}
+_lock = threading.Lock()
+_random = random.Random()
+
+
+# Задержка и случайные ошибки перед каждым ответом, учёт вызовов
+@server.before_request
+def simulate_upstream():
+    if request.path.startswith("/_stats"):
+        return None
+    endpoint = request.path.split("/")[1]
+    with _lock:
+        calls[endpoint] += 1
+        delay = config["latency"] + _random.uniform(0, config["jitter"])
+        failed = _random.random() < config["error_rate"]
+    if delay:
+        time.sleep(delay)
+    if not request.args.get("apikey"):
+        return (
+            jsonify({"Code": "Unauthorized", "Message": "Api Authorization failed"}),
+            401,
+        )
+    if failed:
+        with _lock:
+            calls["errors"] += 1
+        return jsonify({"Code": "ServiceUnavailable", "Message": "Try again"}), 503
+    return None
+
+
+# Location key и координаты города: одинаковые при каждом запуске
+def find_location(query):
+    name = " ".join(query.lower().split())
+    if not name:
+        return None
+    if name in CITIES:
+        localized, lat, lon = CITIES[name]
+    else:
+        digest = zlib.crc32(name.encode())
+        localized = query.strip()
+        lat = 42 + digest % 2500 / 100
+        lon = 28 + digest // 2500 % 6000 / 100
+    key = str(280000 + zlib.crc32(localized.encode()) % 700000)
+    location = {
+        "Version": 1,
+        "Key": key,
+        "Type": "City",
+        "Rank": 21,
+        "LocalizedName": localized,
+        "EnglishName": localized,
+        "Country": {"ID": "RU", "LocalizedName": "Россия", "EnglishName": "Russia"},
+        "TimeZone": {"Code": "MSK", "Name": "Europe/Moscow", "GmtOffset": 3.0},
+        "GeoPosition": {
+            "Latitude": round(lat, 3),
+            "Longitude": round(lon, 3),
+            "Elevation": {"Metric": {"Value": 150.0, "Unit": "m", "UnitType": 5}},
+        },
+    }
+    with _lock:
+        locations[key] = location
+    return location
+
+
+# Прогноз на один день половины суток (Day или Night)
+def half_day(rng, night):
+    icon, phrase = rng.choice(ICONS)
+    speed = round(rng.uniform(3, 25), 1)
+    return {
+        "Icon": icon + (30 if night else 0),
+        "IconPhrase": phrase,
+        "HasPrecipitation": icon >= 12,
+        "Wind": {
+            "Speed": {"Value": speed, "Unit": "km/h", "UnitType": 7},
+            "Direction": {"Degrees": rng.randrange(360), "Localized": "С"},
+        },
+        "WindGust": {
+            "Speed": {
+                "Value": round(speed + rng.uniform(5, 20), 1),
+                "Unit": "km/h",
+                "UnitType": 7,
+            },
+        },
+        "PrecipitationProbability": rng.randrange(0, 101, 5),
+        "CloudCover": rng.randrange(0, 101),
+    }
+
+
+# Прогноз на 5 дней: значения зависят только от города и даты,
+# поэтому в течение суток ответ не меняется
+def forecast(key, days=5):
+    today = date.today()
+    daily = []
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        rng = random.Random(f"{key}:{day.isoformat()}")
+        low = round(rng.uniform(-15, 15), 1)
+        moment = datetime(day.year, day.month, day.day, 7)
+        daily.append(
+            {
+                "Date": f"{moment.isoformat()}+03:00",
+                "EpochDate": int(moment.timestamp()),
+                "Temperature": {
+                    "Minimum": {"Value": low, "Unit": "C", "UnitType": 17},
+                    "Maximum": {
+                        "Value": round(low + rng.uniform(2, 12), 1),
+                        "Unit": "C",
+                        "UnitType": 17,
+                    },
+                },
+                "Day": half_day(rng, night=False),
+                "Night": half_day(rng, night=True),
+                "Sources": ["AccuWeather"],
+            }
+        )
+    return {
+        "Headline": {
+            "EffectiveDate": daily[0]["Date"],
+            "Severity": 4,
+            "Text": "Без существенных изменений",
+            "Category": "",
+        },
+        "DailyForecasts": daily,
+    }
+
+
+@server.route("/locations/v1/cities/search")
+def search_city():
+    location = find_location(request.args.get("q", ""))
+    return jsonify([location] if location else [])
+
+
+@server.route("/locations/v1/<key>")
+def get_location(key):
+    with _lock:
+        location = locations.get(key)
+    if location is None:
+        abort(404)
+    return jsonify(location)
+
+
+@server.route("/forecasts/v1/daily/5day/<key>")
+def get_forecast(key):
+    return jsonify(forecast(key))
+
+
+# Число обращений к каждому методу API: по нему считается,
+# сколько запросов к AccuWeather приходится на один запрос к серверу
+@server.route("/_stats", methods=["GET"])
+def get_stats():
+    with _lock:
+        return jsonify(dict(calls))
+
+
+@server.route("/_stats/reset", methods=["POST"])
+def reset_stats():
+    with _lock:
+        calls.clear()
+    return jsonify({})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка API AccuWeather")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=50, help="задержка ответа, мс")
+    parser.add_argument(
+        "--jitter", type=float, default=20, help="случайная добавка к задержке, мс"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="доля ответов 503"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config["latency"] = args.latency / 1000
+    config["jitter"] = args.jitter / 1000
+    config["error_rate"] = args.error_rate
+    _random.seed(args.seed)
+    server.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from bench.fake_accuweather import CITIES
+
+SCENARIOS = ("get_data", "get_weather", "update_graph", "bot")
+GRAPH_PARAMS = ("Temperature", "Wind Speed", "Precipitation Probability")
+
+_local = threading.local()
+
+
+def session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+# Маршруты для нагрузки: route_size городов из списка заглушки.
+# Чем меньше маршрутов, тем чаще запросы попадают в кэши сервера
+def make_routes(count, route_size, seed):
+    rng = random.Random(seed)
+    names = [name for name, _, _ in CITIES.values()]
+    return [rng.sample(names, route_size) for _ in range(count)]
+
+
+# Запрос к Dash-колбэку так же, как его отправляет браузер
+def dash_call(app_url, callback, inputs, state, changed):
+    body = {
+        "output": callback["output"],
+        "outputs": callback["outputs"],
+        "inputs": inputs,
+        "state": state,
+        "changedPropIds": changed,
+    }
+    response = session().post(f"{app_url}/_dash-update-component", json=body)
+    response.raise_for_status()
+    return response.json()
+
+
+# Описание колбэков get_weather, update_graph и загрузки графиков
+# и карты (load_graph, load_map) из /_dash-dependencies
+def find_callbacks(app_url):
+    callbacks = {}
+    for dependency in session().get(f"{app_url}/_dash-dependencies").json():
+        output = dependency["output"]
+        inputs = [item["id"] for item in dependency["inputs"]]
+        if "weather-graphs.children" in output:
+            callbacks["get_weather"] = {
+                "output": output,
+                "outputs": [
+                    {"id": "weather-graphs", "property": "children"},
+                    {"id": "error-alert", "property": "is_open"},
+                    {"id": "error-alert", "property": "children"},
+                ],
+            }
+        elif '"type":"forecast-type-radio"' in "".join(inputs):
+            callbacks["update_graph"] = {
+                "output": output,
+                "clientside": bool(dependency.get("clientside_function")),
+            }
+        elif '"type":"forecast-graph"' in "".join(inputs):
+            callbacks["load_graph"] = {"output": output}
+        elif '"type":"route-map"' in "".join(inputs):
+            callbacks["load_map"] = {"output": output}
+    return callbacks
+
+
+def get_weather(app_url, callbacks, route):
+    return dash_call(
+        app_url,
+        callbacks["get_weather"],
+        [{"id": "submit-btn", "property": "n_clicks", "value": 1}],
+        [
+            {"id": "start-city", "property": "value", "value": route[0]},
+            {"id": "end-city", "property": "value", "value": route[-1]},
+            [
+                {
+                    "id": {"type": "intermediate-city", "index": index},
+                    "property": "value",
+                    "value": city,
+                }
+                for index, city in enumerate(route[1:-1])
+            ],
+        ],
+        ["submit-btn.n_clicks"],
+    )
+
+
+# id графиков городов (или других компонентов типа kind) в ответе get_weather
+def find_graph_ids(node, kind="forecast-graph"):
+    if isinstance(node, dict):
+        node_id = node.get("id")
+        if isinstance(node_id, dict) and node_id.get("type") == kind:
+            yield node_id
+        for value in node.values():
+            yield from find_graph_ids(value, kind)
+    elif isinstance(node, list):
+        for value in node:
+            yield from find_graph_ids(value, kind)
+
+
+def load_graph(app_url, callbacks, graph_id):
+    return dash_call(
+        app_url,
+        {
+            "output": callbacks["load_graph"]["output"],
+            "outputs": {"id": graph_id, "property": "figure"},
+        },
+        [{"id": graph_id, "property": "id", "value": graph_id}],
+        [
+            {
+                "id": {**graph_id, "type": "forecast-type-radio"},
+                "property": "value",
+                "value": "Temperature",
+            },
+            {
+                "id": {**graph_id, "type": "forecast-days-slider"},
+                "property": "value",
+                "value": 3,
+            },
+        ],
+        [],
+    )
+
+
+def load_map(app_url, callbacks, map_id):
+    return dash_call(
+        app_url,
+        {
+            "output": callbacks["load_map"]["output"],
+            "outputs": [
+                {"id": map_id, "property": "figure"},
+                {"id": {**map_id, "type": "route-profile"}, "property": "figure"},
+            ],
+        },
+        [{"id": map_id, "property": "id", "value": map_id}],
+        [],
+        [],
+    )
+
+
+# Загрузка страницы маршрута целиком: get_weather, затем, как в браузере,
+# параллельно графики всех городов и карта
+def load_route(app_url, callbacks, route):
+    result = get_weather(app_url, callbacks, route)
+    if result["response"]["error-alert"]["is_open"]:
+        return False
+    children = result["response"]["weather-graphs"]["children"]
+    calls = [(load_graph, graph_id) for graph_id in find_graph_ids(children)] + [
+        (load_map, map_id) for map_id in find_graph_ids(children, "route-map")
+    ]
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [
+            executor.submit(call, app_url, callbacks, item) for call, item in calls
+        ]
+        for future in futures:
+            future.result()
+    return True
+
+
+def update_graph(app_url, callbacks, graph_id, rng):
+    radio = {**graph_id, "type": "forecast-type-radio"}
+    slider = {**graph_id, "type": "forecast-days-slider"}
+    radio_key = json.dumps(radio, sort_keys=True, separators=(",", ":"))
+    return dash_call(
+        app_url,
+        {
+            "output": callbacks["update_graph"]["output"],
+            "outputs": {"id": graph_id, "property": "figure"},
+        },
+        [
+            {"id": radio, "property": "value", "value": rng.choice(GRAPH_PARAMS)},
+            {"id": slider, "property": "value", "value": rng.randint(1, 5)},
+        ],
+        [],
+        [f"{radio_key}.value"],
+    )
+
+
+# Один запрос сценария; возвращает True, если ответ успешный
+def http_request(scenario, app_url, routes, callbacks, graphs, rng):
+    if scenario == "get_data":
+        route = rng.choice(routes)
+        response = session().get(
+            f"{app_url}/get_data", params={"cities": ",".join(route)}
+        )
+        return response.status_code == 200
+    if scenario == "get_weather":
+        return load_route(app_url, callbacks, rng.choice(routes))
+    update_graph(app_url, callbacks, rng.choice(graphs), rng)
+    return True
+
+
+def run_http(scenario, app_url, routes, callbacks, graphs, concurrency, total, seed):
+    def one(index):
+        rng = random.Random(seed * 1000003 + index)
+        started = time.perf_counter()
+        try:
+            ok = http_request(scenario, app_url, routes, callbacks, graphs, rng)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(one, range(total)))
+
+
+# Заглушки aiogram для вызова обработчика process_days без Telegram
+class FakeMessage:
+    def __init__(self, chat_id):
+        self.chat = types.SimpleNamespace(id=chat_id)
+        self.sent = []
+
+    async def answer(self, text, **kwargs):
+        self.sent.append(text)
+
+
+class FakeCallback:
+    def __init__(self, data, chat_id):
+        self.data = data
+        self.message = FakeMessage(chat_id)
+
+
+class FakeState:
+    def __init__(self, data):
+        self.data = dict(data)
+
+    async def update_data(self, **kwargs):
+        self.data.update(kwargs)
+
+    async def get_data(self):
+        return dict(self.data)
+
+    async def clear(self):
+        self.data = {}
+
+
+async def run_bot(app_url, routes, concurrency, total, seed):
+    import bot
+
+    bot.backend = bot.BackendClient(app_url, bot.BACKEND_TIMEOUT)
+    await bot.backend.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        route = random.Random(seed * 1000003 + index).choice(routes)
+        state = FakeState(
+            {
+                "start_city": route[:1],
+                "end_city": route[-1:],
+                "intermediate_cities": route[1:-1],
+            }
+        )
+        callback = FakeCallback("5", chat_id=index + 1)
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.process_days(callback, state)
+            elapsed = time.perf_counter() - started
+        sent = callback.message.sent
+        return elapsed, bool(sent) and "Вы можете" in sent[-1]
+
+    try:
+        return await asyncio.gather(*(one(index) for index in range(total)))
+    finally:
+        await bot.backend.close()
+
+
+def upstream_calls(fake_url):
+    stats = session().get(f"{fake_url}/_stats").json()
+    return sum(value for key, value in stats.items() if key != "errors")
+
+
+def summarize(scenario, concurrency, results, elapsed, calls):
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(not ok for _, ok in results),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "rps": round(len(results) / elapsed, 1),
+        "upstream_per_request": round(calls / len(results), 3),
+    }
+
+
+def print_report(rows):
+    columns = list(rows[0])
+    widths = [
+        max(len(str(row[column])) for row in rows + [dict(zip(columns, columns))])
+        for column in columns
+    ]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print(
+            "  ".join(
+                str(row[column]).rjust(width) for column, width in zip(columns, widths)
+            )
+        )
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} не отвечает")
+
+
+# Запуск заглушки и сервера приложения в отдельных процессах.
+# Настройки сервера (CACHE_BACKEND, FETCH_WORKERS и т. д.) берутся
+# из окружения; лимит запросов к заглушке по умолчанию выключен
+@contextlib.contextmanager
+def spawn(args):
+    fake_port = args.fake_url.rsplit(":", 1)[1]
+    app_port = args.app_url.rsplit(":", 1)[1]
+    env = dict(os.environ, ACCUWEATHER_URL=args.fake_url)
+    env.setdefault("API_KEY", "bench")
+    env.setdefault("ACCUWEATHER_RPS", "0")
+    output = None if args.verbose else subprocess.DEVNULL
+    commands = [
+        [sys.executable, "-m", "bench.fake_accuweather", "--port", fake_port]
+        + ["--latency", str(args.latency), "--jitter", str(args.jitter)]
+        + ["--error-rate", str(args.error_rate)],
+        [sys.executable, "-m", "flask", "--app", "app:server", "run"]
+        + ["--port", app_port, "--with-threads"],
+    ]
+    processes = [
+        subprocess.Popen(command, env=env, stdout=output, stderr=output)
+        for command in commands
+    ]
+    try:
+        wait_ready(f"{args.fake_url}/_stats")
+        wait_ready(f"{args.app_url}/metrics")
+        yield
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def run(args):
+    routes = make_routes(args.routes, args.route_size, args.seed)
+    callbacks, graphs = {}, []
+    if {"get_weather", "update_graph"} & set(args.scenarios):
+        callbacks = find_callbacks(args.app_url)
+    if "bot" in args.scenarios:
+        # Замеряется работа бота с сервером, а не лимиты Telegram
+        # на отправку сообщений (если они не заданы явно)
+        for name in (
+            "TELEGRAM_CHAT_RATE",
+            "TELEGRAM_GROUP_RATE",
+            "TELEGRAM_GLOBAL_RATE",
+        ):
+            os.environ.setdefault(name, "0")
+        # aiogram импортируется до замеров
+        import bot  # noqa: F401
+
+    rows = []
+    for scenario in args.scenarios:
+        if scenario == "update_graph":
+            if callbacks["update_graph"]["clientside"]:
+                print("update_graph выполняется в браузере (CLIENTSIDE_GRAPHS=1)")
+                continue
+            # Маршруты для изменения графиков строятся до замеров
+            for route in routes:
+                graphs.extend(
+                    find_graph_ids(get_weather(args.app_url, callbacks, route))
+                )
+        for concurrency in args.concurrency:
+            session().post(f"{args.fake_url}/_stats/reset")
+            started = time.perf_counter()
+            if scenario == "bot":
+                results = asyncio.run(
+                    run_bot(args.app_url, routes, concurrency, args.requests, args.seed)
+                )
+            else:
+                results = run_http(
+                    scenario,
+                    args.app_url,
+                    routes,
+                    callbacks,
+                    graphs,
+                    concurrency,
+                    args.requests,
+                    args.seed,
+                )
+            elapsed = time.perf_counter() - started
+            calls = upstream_calls(args.fake_url)
+            rows.append(summarize(scenario, concurrency, results, elapsed, calls))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера прогнозов")
+    parser.add_argument("--app-url", default="http://127.0.0.1:8050")
+    parser.add_argument("--fake-url", default="http://127.0.0.1:8001")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"через запятую: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(item) for item in value.split(",")],
+        default=[1, 8, 32],
+        help="уровни параллельности через запятую",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="запросов на каждый уровень"
+    )
+    parser.add_argument("--routes", type=int, default=20, help="число разных маршрутов")
+    parser.add_argument("--route-size", type=int, default=3, help="городов в маршруте")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в файл JSON")
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="запустить заглушку и сервер приложения самостоятельно",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=50, help="задержка заглушки, мс"
+    )
+    parser.add_argument("--jitter", type=float, default=20, help="разброс задержки, мс")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="доля ответов 503"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="не скрывать вывод серверов"
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    with spawn(args) if args.spawn else contextlib.nullcontext():
+        rows = run(args)
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(rows, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
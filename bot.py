@@ -1,12 +1,18 @@
 import asyncio
+import json
 import logging
+import math
 import sys
-import requests
+import time
+from collections import deque
 from os import getenv
 
+import aiohttp
+
 from aiogram import Bot, Dispatcher, F, html
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -19,13 +25,191 @@ from aiogram.types import (
     ReplyKeyboardRemove,
 )
 
+from cache import LRUCache
+from upstream import RateLimiter
+
 BOT_TOKEN = getenv("BOT_TOKEN")
+BACKEND_URL = getenv("BACKEND_URL", "http://127.0.0.1:8050")
+BACKEND_TIMEOUT = float(getenv("BACKEND_TIMEOUT", "30"))
+# Лимиты Telegram на отправку сообщений в секунду: в один личный чат,
+# в одну группу (20 в минуту) и всего от бота. 0 - без ограничения
+TELEGRAM_CHAT_RATE = float(getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+TELEGRAM_GLOBAL_RATE = float(getenv("TELEGRAM_GLOBAL_RATE", "30"))
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+logger = logging.getLogger(__name__)
 
 dp = Dispatcher()
 
 user_data = {}
 
 
+# Асинхронный клиент для /get_data. Одна сессия с пулом соединений
+# создаётся при запуске бота и закрывается при остановке, поэтому
+# ожидание ответа сервера не блокирует обработку других чатов
+class BackendClient:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            timeout=self.timeout, connector=aiohttp.TCPConnector(limit=100)
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # Потоковый запрос: прогнозы городов приходят по одному (NDJSON),
+    # как только каждый из них готов
+    async def stream_data(self, cities):
+        async with self.session.get(
+            f"{self.base_url}/get_data",
+            params={"cities": ",".join(cities), "stream": "1"},
+        ) as response:
+            if response.status != 200:
+                data = await response.json()
+                yield {"error": data.get("error"), "status": response.status}
+                return
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+
+backend = BackendClient(BACKEND_URL, BACKEND_TIMEOUT)
+
+
+# Разбиение текста длиннее limit на части по границам строк
+def split_text(text, limit=MESSAGE_LIMIT):
+    chunks = []
+    chunk = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if chunk:
+                chunks.append(chunk)
+                chunk = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(chunk) + len(line) > limit:
+            chunks.append(chunk)
+            chunk = ""
+        chunk += line
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+# Очередь исходящих сообщений. У каждого чата своя очередь и свой
+# token bucket, общий bucket ограничивает все отправки бота. Пока чат
+# ждёт своей очереди, накопившиеся короткие сообщения объединяются
+# в одно (до MESSAGE_LIMIT символов). Ответ 429 Telegram возвращает
+# и при превышении лимита одного чата (чаще всего группы), а отличить его
+# от лимита всего бота нельзя, поэтому retry_after секунд ждёт только
+# этот чат, а затем сообщение отправляется повторно
+class Outbox:
+    def __init__(self, chat_rate, group_rate, global_rate, limit=MESSAGE_LIMIT):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.limit = limit
+        self.limiter = RateLimiter(global_rate, max_wait=math.inf)
+        # Лимитеры чатов хранятся и после опустошения очереди, чтобы
+        # новое сообщение не ушло раньше, чем позволяет лимит
+        self._chat_limiters = LRUCache(maxsize=10000, ttl=600)
+        # Момент окончания паузы чата по retry_after
+        self._chat_pauses = LRUCache(maxsize=10000)
+        self._queues = {}
+        self._workers = {}
+
+    # send - корутина отправки текста в чат, например message.answer
+    def send(self, chat_id, text, send):
+        queue = self._queues.setdefault(chat_id, deque())
+        for chunk in split_text(text, self.limit):
+            queue.append((chunk, send))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.ensure_future(self._deliver(chat_id))
+
+    # Ожидание отправки всех сообщений чата
+    async def flush(self, chat_id):
+        worker = self._workers.get(chat_id)
+        if worker is not None:
+            await asyncio.shield(worker)
+
+    async def _deliver(self, chat_id):
+        queue = self._queues[chat_id]
+        limiter = self._chat_limiter(chat_id)
+        try:
+            while queue:
+                await limiter.acquire_async()
+                await self._acquire(chat_id)
+                text, send = self._merge(queue)
+                while True:
+                    try:
+                        await send(text)
+                        break
+                    except TelegramRetryAfter as error:
+                        self._chat_pauses.set(
+                            chat_id,
+                            time.monotonic() + error.retry_after,
+                            ttl=error.retry_after,
+                        )
+                        await self._acquire(chat_id)
+                    except TelegramAPIError:
+                        logger.exception(
+                            "Не удалось отправить сообщение в чат %s", chat_id
+                        )
+                        break
+        finally:
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+
+    # Токен общего лимита, взятый после окончания паузы чата по retry_after
+    async def _acquire(self, chat_id):
+        while True:
+            delay = self._pause_left(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.limiter.acquire_async()
+            if self._pause_left(chat_id) <= 0:
+                return
+
+    def _pause_left(self, chat_id):
+        return self._chat_pauses.get(chat_id, 0.0) - time.monotonic()
+
+    # Первые сообщения очереди, объединённые в один текст
+    def _merge(self, queue):
+        text, send = queue.popleft()
+        while queue and len(text) + 2 + len(queue[0][0]) <= self.limit:
+            text += "\n\n" + queue.popleft()[0]
+        return text, send
+
+    def _chat_limiter(self, chat_id):
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            limiter = RateLimiter(rate, max_wait=math.inf)
+            self._chat_limiters.set(chat_id, limiter)
+        return limiter
+
+
+outbox = Outbox(TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_GLOBAL_RATE)
+
+
+@dp.startup()
+async def on_startup() -> None:
+    await backend.start()
+
+
+@dp.shutdown()
+async def on_shutdown() -> None:
+    await backend.close()
+
+
 class WeatherState(StatesGroup):
     start_city = State()
     end_city = State()
@@ -118,31 +302,39 @@ async def process_days(callback: CallbackQuery, state: FSMContext):
     end_city = data["end_city"]
     intermediate_cities = data["intermediate_cities"]
     days = int(data["days"])
-    print(days, type(days))
 
     cities = start_city + intermediate_cities + end_city
-    params = {
-        "cities": ",".join(cities),
-    }
-    response = requests.get(f"http://127.0.0.1:8050/get_data", params=params)
-    print(response.url)
-    if response.status_code == 200:
-        cities_data = response.json()
-        for city in cities_data:
-            forecast_data = city.get("forecast")
-            msg = f"Прогноз погоды в городе {html.bold(city.get('name'))}\n"
-            for day in forecast_data[:days]:
-                msg += f"\nДата: {day.get('Date')}\nТемпература (°C): {day.get('Temperature')}\nСкорость ветра (м/c): {day.get('Wind Speed')}\
-                    \nВероятность осадков (%): {day.get('Precipitation Probability')}\n"
-            await callback.message.answer(msg)
-
-        await callback.message.answer(
-            f"Вы можете ознакомиться с графиками по данной ссылке http://127.0.0.1:8050?start-city={start_city[0]}&end-city={end_city[0]}"
-        )
+    chat_id = callback.message.chat.id
+
+    # Сообщения отправляются через общую очередь с учётом лимитов Telegram
+    def answer(text):
+        outbox.send(chat_id, text, callback.message.answer)
+
+    has_errors = False
+    try:
+        async for city in backend.stream_data(cities):
+            if city.get("error"):
+                has_errors = True
+                answer(city["error"])
+            else:
+                answer(format_forecast(city, days))
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        answer("Сервис погоды не отвечает, попробуйте позже")
     else:
-        error_data = response.json()
-        print(error_data)
-        await callback.message.answer(error_data.get("error"))
+        if not has_errors:
+            answer(
+                f"Вы можете ознакомиться с графиками по данной ссылке http://127.0.0.1:8050?start-city={start_city[0]}&end-city={end_city[0]}"
+            )
+    await outbox.flush(chat_id)
+
+
+# Текст сообщения с прогнозом для одного города
+def format_forecast(city, days):
+    msg = f"Прогноз погоды в городе {html.bold(city.get('name'))}\n"
+    for day in city.get("forecast")[:days]:
+        msg += f"\nДата: {day.get('Date')}\nТемпература (°C): {day.get('Temperature')}\nСкорость ветра (м/c): {day.get('Wind Speed')}\
+                    \nВероятность осадков (%): {day.get('Precipitation Probability')}\n"
+    return msg
 
 
 @dp.message()
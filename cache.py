@@ -0,0 +1,478 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# LRU-кэш в памяти с ограничением по размеру и времени жизни записей
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# LRU-кэш с ограничением по суммарному размеру значений; слишком большие
+# значения не кэшируются. Размер значения считает sizeof (по умолчанию len,
+# для строк), он вызывается один раз при записи
+class SizedLRUCache:
+    def __init__(self, max_bytes, max_item_bytes=None, sizeof=len):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes or max_bytes
+        self.sizeof = sizeof
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        if size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Ключ для общего хранилища: строки как есть, остальное (кортежи) в JSON
+def cache_key(key):
+    if isinstance(key, str):
+        return key
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+
+# Кэш на диске (SQLite): значения хранятся в JSON. Раз в sweep_interval
+# записей удаляются истёкшие записи, а если их больше max_entries -
+# записи, к которым дольше всего не обращались, до 90% от max_entries.
+# Файл в режиме WAL, поэтому его одновременно читают несколько процессов.
+# Изменённые ключи записываются в таблицу {table}_changes, чтобы другие
+# процессы могли сбросить свои копии в памяти (см. PersistentCache),
+# вместе с меткой записавшего их экземпляра кэша. Соединение открывается
+# при создании и не переживает fork(): каждый процесс создаёт свой кэш
+class SQLiteCache:
+    def __init__(
+        self,
+        path,
+        table="cache",
+        ttl=None,
+        max_entries=None,
+        touch_interval=60,
+        sweep_interval=256,
+    ):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.sweep_interval = sweep_interval
+        self._writes = 0
+        self._id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires REAL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)"
+        )
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table}_changes ("
+            "key TEXT PRIMARY KEY, changed REAL NOT NULL, writer TEXT)"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_changes_changed "
+            f"ON {table}_changes (changed)"
+        )
+        self._conn.commit()
+
+    def get(self, key, default=None):
+        key = cache_key(key)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires, accessed FROM {self.table} WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return default
+            value, expires, accessed = row
+            if expires is not None and expires < now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return default
+            # Время обращения обновляется не чаще раза в touch_interval
+            # секунд: иначе каждое чтение ждало бы блокировку записи
+            if now - accessed > self.touch_interval:
+                self._conn.execute(
+                    f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key)
+                )
+                self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        key = cache_key(key)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires, now),
+            )
+            self._changed(key, now)
+            self._writes += 1
+            if self._writes >= self.sweep_interval:
+                self._writes = 0
+                self._sweep(now)
+            self._conn.commit()
+
+    def delete(self, key):
+        key = cache_key(key)
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._changed(key, time.time())
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._changed("*", time.time())
+            self._conn.commit()
+
+    # Все действующие записи (key, value) или только изменённые после since
+    def items(self, since=None):
+        query = f"SELECT key, value FROM {self.table} WHERE "
+        params = [time.time()]
+        if since is not None:
+            query += (
+                f"key IN (SELECT key FROM {self.table}_changes WHERE changed > ?) AND "
+            )
+            params.insert(0, since)
+        query += "(expires IS NULL OR expires >= ?)"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    # Ключи, изменённые после момента since ("*" - кэш очищен целиком).
+    # Изменения, сделанные через этот же экземпляр, пропускаются
+    def changes_since(self, since):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key FROM {self.table}_changes "
+                "WHERE changed > ? AND writer IS NOT ?",
+                (since, self._id),
+            ).fetchall()
+        return [key for key, in rows]
+
+    # Удаление истёкших записей и лишних записей сверх max_entries
+    def _sweep(self, now):
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (now,))
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count <= self.max_entries:
+            return
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)",
+            (count - int(self.max_entries * 0.9),),
+        )
+
+    def _changed(self, key, now):
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self.table}_changes (key, changed, writer) "
+            "VALUES (?, ?, ?)",
+            (key, now, self._id),
+        )
+        # Старые записи об изменениях уже никому не нужны
+        self._conn.execute(
+            f"DELETE FROM {self.table}_changes WHERE changed < ?", (now - 3600,)
+        )
+
+
+# Двухуровневый кэш: кэш в памяти процесса (по умолчанию LRUCache)
+# перед общим хранилищем на диске. Не чаще раза в sync_interval секунд
+# из хранилища читается список ключей, изменённых другими процессами,
+# и их копии в памяти удаляются, поэтому процессы видят записи друг друга.
+# Свои записи процесс не сбрасывает: в памяти уже лежит то же значение
+class PersistentCache:
+    def __init__(
+        self,
+        path,
+        table="cache",
+        ttl=None,
+        memory_size=1024,
+        max_entries=None,
+        memory=None,
+        sync_interval=1.0,
+    ):
+        self.memory = memory if memory is not None else LRUCache(memory_size, ttl)
+        self.disk = SQLiteCache(path, table=table, ttl=ttl, max_entries=max_entries)
+        self.sync_interval = sync_interval
+        self._synced = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        key = cache_key(key)
+        self._sync()
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is None:
+            return default
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        key = cache_key(key)
+        self.memory.set(key, value, ttl)
+        self.disk.set(key, value, ttl)
+
+    def delete(self, key):
+        key = cache_key(key)
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def items(self, since=None):
+        return self.disk.items(since)
+
+    def _sync(self):
+        now = time.time()
+        with self._lock:
+            if now - self._synced < self.sync_interval:
+                return
+            since, self._synced = self._synced, now
+        # Небольшой запас на случай неточно синхронизированных часов записи
+        for key in self.disk.changes_since(since - 1):
+            if key == "*":
+                self.memory.clear()
+                break
+            self.memory.delete(key)
+
+
+# Кэш для данных приложения: общий для всех процессов (backend="sqlite")
+# или только в памяти процесса (backend="memory")
+def make_cache(
+    backend,
+    memory,
+    path=None,
+    table="cache",
+    ttl=None,
+    max_entries=None,
+    sync_interval=1.0,
+):
+    if backend == "sqlite":
+        return PersistentCache(
+            path,
+            table=table,
+            ttl=ttl,
+            max_entries=max_entries,
+            memory=memory,
+            sync_interval=sync_interval,
+        )
+    if backend != "memory":
+        raise ValueError(f"Неизвестный тип кэша: {backend}")
+    return memory
+
+
+# Кэш с обновлением в фоне (stale-while-revalidate): свежие записи
+# отдаются сразу, устаревшие в пределах grace тоже отдаются, но
+# одновременно обновляются в фоне; после grace значение загружается заново.
+# entries - хранилище записей (по умолчанию LRUCache в памяти)
+class RefreshingCache:
+    def __init__(self, fetch, ttl, grace=0, maxsize=1024, workers=2, entries=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.grace = grace
+        if entries is None:
+            entries = LRUCache(maxsize=maxsize, ttl=ttl + grace)
+        self.entries = entries
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "errors": 0}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, fetched = entry
+            if time.time() - fetched < self.ttl:
+                self._count("hits")
+            else:
+                self._count("stale")
+                self._schedule_refresh(key)
+            return value
+        self._count("misses")
+        return self._load(key)
+
+    def set(self, key, value):
+        self.entries.set(key, (value, time.time()))
+
+    def delete(self, key):
+        self.entries.delete(key)
+
+    # Сколько секунд назад было загружено значение (None, если его нет)
+    def age(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return time.time() - entry[1]
+
+    # Загрузка нового значения сразу, не дожидаясь истечения TTL
+    def refresh(self, key):
+        value = self._load(key)
+        self._count("refreshes")
+        return value
+
+    def _load(self, key):
+        value = self.fetch(key)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def _schedule_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key)
+
+    def _refresh(self, key):
+        try:
+            self._load(key)
+            self._count("refreshes")
+        except Exception:
+            self._count("errors")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+# RefreshingCache для asyncio: fetch - корутина, фоновое обновление
+# выполняется задачей в том же цикле событий. Хранилище entries можно
+# разделить с обычным RefreshingCache; обращения к нему (SQLite может
+# ждать блокировку) выполняются в потоке, а не в цикле событий
+class AsyncRefreshingCache(RefreshingCache):
+    def __init__(self, fetch, ttl, grace=0, maxsize=1024, entries=None):
+        super().__init__(fetch, ttl, grace, maxsize, workers=1, entries=entries)
+        self._tasks = set()
+
+    async def get(self, key):
+        entry = await asyncio.to_thread(self.entries.get, key)
+        if entry is not None:
+            value, fetched = entry
+            if time.time() - fetched < self.ttl:
+                self._count("hits")
+            else:
+                self._count("stale")
+                self._schedule_refresh(key)
+            return value
+        self._count("misses")
+        return await self._load(key)
+
+    async def refresh(self, key):
+        value = await self._load(key)
+        self._count("refreshes")
+        return value
+
+    async def _load(self, key):
+        value = await self.fetch(key)
+        if value is not None:
+            await asyncio.to_thread(self.set, key, value)
+        return value
+
+    def _schedule_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        task = asyncio.ensure_future(self._refresh(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key):
+        try:
+            await self._load(key)
+            self._count("refreshes")
+        except Exception:
+            self._count("errors")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
@@ -0,0 +1,340 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from os import getenv
+import hashlib
+import json
+
+from cache import LRUCache, PersistentCache, RefreshingCache, make_cache
+import metrics
+from locations import Location, LocationResolver, normalize_city_name
+from prefetch import PrefetchScheduler
+from singleflight import SingleFlight
+from snapshots import SnapshotClient, SnapshotStore
+from upstream import RateLimiter, SharedRateLimiter, UpstreamClient, UpstreamError
+
+API_KEY = getenv("API_KEY")
+ACCUWEATHER_URL = getenv("ACCUWEATHER_URL", "http://dataservice.accuweather.com")
+# Максимальное число городов маршрута, запрашиваемых одновременно
+FETCH_WORKERS = int(getenv("FETCH_WORKERS", "8"))
+# То же для пакетных запросов и точек вдоль маршрута
+BULK_FETCH_WORKERS = int(getenv("BULK_FETCH_WORKERS", "4"))
+# Писать в лог длительность этапов каждого запроса
+TIMING_LOG = getenv("TIMING_LOG", "0") == "1"
+LANGUAGE = "ru-RU"
+# Где хранить прогнозы, графики и маршруты: "memory" - в памяти процесса,
+# "sqlite" - в общем файле CACHE_PATH, который видят все процессы сервера
+CACHE_BACKEND = getenv("CACHE_BACKEND", "memory")
+CACHE_PATH = getenv("CACHE_PATH", "cache.sqlite3")
+CACHE_SYNC_INTERVAL = float(getenv("CACHE_SYNC_INTERVAL", "1"))
+# Запись ответов AccuWeather на диск: "off", "record", "replay" или
+# "fallback" (см. snapshots.py)
+SNAPSHOT_MODE = getenv("SNAPSHOT_MODE", "off")
+SNAPSHOT_PATH = getenv("SNAPSHOT_PATH", "snapshots")
+# Размер файла сохранённых ответов, после которого старые ответы удаляются
+SNAPSHOT_MAX_BYTES = int(getenv("SNAPSHOT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Кэш найденных городов: location key, название и координаты
+location_cache = PersistentCache(
+    getenv("LOCATION_CACHE_PATH", "locations.sqlite3"),
+    table="locations",
+    ttl=int(getenv("LOCATION_CACHE_TTL", str(30 * 24 * 3600))),
+    memory_size=int(getenv("LOCATION_CACHE_MEMORY_SIZE", "1024")),
+    max_entries=int(getenv("LOCATION_CACHE_MAX_ENTRIES", "100000")),
+    sync_interval=CACHE_SYNC_INTERVAL,
+)
+
+
+ACCUWEATHER_RPS = float(getenv("ACCUWEATHER_RPS", "10"))
+ACCUWEATHER_DAILY_QUOTA = int(getenv("ACCUWEATHER_DAILY_QUOTA", "0"))
+
+
+# Ограничение частоты запросов к AccuWeather. При CACHE_BACKEND=sqlite
+# оно общее для всех процессов сервера (хранится в CACHE_PATH)
+def make_limiter(name, rate, daily_quota, max_wait):
+    if CACHE_BACKEND == "sqlite":
+        return SharedRateLimiter(CACHE_PATH, name, rate, daily_quota, max_wait)
+    return RateLimiter(rate, daily_quota, max_wait)
+
+
+# Настройки клиентов AccuWeather (обычного и асинхронного): общий
+# лимит запросов, таймауты, повторы и размер пула соединений
+UPSTREAM_SETTINGS = {
+    "limiter": make_limiter(
+        "accuweather",
+        ACCUWEATHER_RPS,
+        ACCUWEATHER_DAILY_QUOTA,
+        float(getenv("ACCUWEATHER_QUEUE_TIMEOUT", "2")),
+    ),
+    "timeout": float(getenv("UPSTREAM_TIMEOUT", "5")),
+    "deadline": float(getenv("UPSTREAM_DEADLINE", "15")),
+    "retries": int(getenv("UPSTREAM_RETRIES", "2")),
+    "pool_size": int(getenv("UPSTREAM_POOL_SIZE", "20")),
+}
+
+# Клиент AccuWeather с пулом соединений, повторами и лимитом запросов
+upstream = UpstreamClient(ACCUWEATHER_URL, API_KEY, **UPSTREAM_SETTINGS)
+# Сохранённые ответы AccuWeather для разработки, нагрузочных тестов
+# и работы при недоступности сервиса
+if SNAPSHOT_MODE != "off":
+    snapshot_store = SnapshotStore(SNAPSHOT_PATH, SNAPSHOT_MAX_BYTES)
+    upstream = SnapshotClient(upstream, snapshot_store, SNAPSHOT_MODE)
+    metrics.register_stats(
+        "sync", upstream.stats, metric="snapshot_events_total", label="client"
+    )
+
+# Одновременные одинаковые запросы к AccuWeather выполняются один раз
+upstream_calls = SingleFlight()
+
+
+# Поиск города в AccuWeather. Ответ уже содержит координаты,
+# поэтому отдельный запрос /locations/v1/{key} не нужен
+def request_location(city_name):
+    response = upstream.get(
+        "/locations/v1/cities/search", {"q": city_name, "language": LANGUAGE}
+    )
+    return parse_location(response, city_name)
+
+
+# Из ответа поиска сохраняются только нужные поля первого города
+def parse_location(response, city_name):
+    if response.status_code == 200 and response.json():
+        location = response.json()[0]
+        return {
+            "Key": location["Key"],
+            "LocalizedName": location.get("LocalizedName", city_name),
+            "GeoPosition": location.get("GeoPosition", {}),
+        }
+    return None
+
+
+def search_location(city_name):
+    key = ("location", normalize_city_name(city_name, LANGUAGE))
+    return upstream_calls.do(key, request_location, city_name)
+
+
+location_resolver = LocationResolver(search_location, location_cache, LANGUAGE)
+
+
+# Загрузка прогноза погоды на 5 дней из AccuWeather
+def request_forecast_data(location_key):
+    response = upstream.get(
+        f"/forecasts/v1/daily/5day/{location_key}",
+        {"metric": "true", "details": "true"},
+    )
+    return parse_forecast(response)
+
+
+def parse_forecast(response):
+    if response.status_code == 200 and response.json():
+        return response.json()["DailyForecasts"]
+    return None
+
+
+def fetch_forecast_data(location_key):
+    return upstream_calls.do(
+        ("forecast", location_key), request_forecast_data, location_key
+    )
+
+
+# Кэш прогнозов по location key. AccuWeather обновляет прогноз лишь
+# несколько раз в час, поэтому после TTL прогноз ещё FORECAST_CACHE_GRACE
+# секунд отдаётся из кэша, а в фоне загружается новый
+FORECAST_CACHE_TTL = int(getenv("FORECAST_CACHE_TTL", "1200"))
+FORECAST_CACHE_GRACE = int(getenv("FORECAST_CACHE_GRACE", "600"))
+FORECAST_CACHE_SIZE = int(getenv("FORECAST_CACHE_SIZE", "4096"))
+
+forecast_cache = RefreshingCache(
+    fetch_forecast_data,
+    ttl=FORECAST_CACHE_TTL,
+    grace=FORECAST_CACHE_GRACE,
+    entries=make_cache(
+        CACHE_BACKEND,
+        LRUCache(
+            maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL + FORECAST_CACHE_GRACE
+        ),
+        CACHE_PATH,
+        table="forecasts",
+        ttl=FORECAST_CACHE_TTL + FORECAST_CACHE_GRACE,
+        max_entries=FORECAST_CACHE_SIZE * 10,
+        sync_interval=CACHE_SYNC_INTERVAL,
+    ),
+)
+
+
+# Фоновое обновление прогнозов популярных городов до истечения их TTL.
+# Включается, если PREFETCH_TOP_N больше нуля
+PREFETCH_INTERVAL = float(getenv("PREFETCH_INTERVAL", "60"))
+PREFETCH_QUOTA_SHARE = float(getenv("PREFETCH_QUOTA_SHARE", "0.2"))
+
+prefetcher = PrefetchScheduler(
+    forecast_cache,
+    limiter=upstream.limiter,
+    top_n=int(getenv("PREFETCH_TOP_N", "0")),
+    half_life=float(getenv("PREFETCH_HALF_LIFE", "3600")),
+    interval=PREFETCH_INTERVAL,
+    lead=float(getenv("PREFETCH_LEAD", "120")),
+    quota_share=PREFETCH_QUOTA_SHARE,
+    # Доля лимита на обновления - одна на все процессы сервера
+    pacer=make_limiter(
+        "prefetch",
+        ACCUWEATHER_RPS * PREFETCH_QUOTA_SHARE,
+        int(ACCUWEATHER_DAILY_QUOTA * PREFETCH_QUOTA_SHARE),
+        PREFETCH_INTERVAL,
+    ),
+)
+if prefetcher.top_n > 0:
+    prefetcher.start()
+
+
+# Функция для получения данных прогноза погоды на 5 дней
+@metrics.timed("get_forecast_data")
+def get_forecast_data(location_key):
+    return forecast_cache.get(location_key)
+
+
+# Получение данных о городе и прогноза для него
+def fetch_city_forecast(city_name):
+    with metrics.timer("resolve_location"):
+        location = location_resolver.resolve(city_name)
+    if not location:
+        return None, None
+    data = get_forecast_data(location.key)
+    if data:
+        prefetcher.record(location.key)
+    return location, data
+
+
+# Общие для всех запросов пулы потоков: fetch_executor - для городов
+# маршрута в обычных запросах, bulk_executor - для пакетных запросов
+# и точек вдоль маршрута, чтобы длинная очередь их задач не задерживала
+# обычные запросы. Вместе они меньше пула соединений UpstreamClient.
+# Задачи не должны сами вызывать fan_out, иначе пул может заблокироваться
+fetch_executor = ThreadPoolExecutor(
+    max_workers=FETCH_WORKERS, thread_name_prefix="fetch"
+)
+bulk_executor = ThreadPoolExecutor(
+    max_workers=BULK_FETCH_WORKERS, thread_name_prefix="bulk-fetch"
+)
+
+
+# Параллельный вызов fetch для каждого элемента в executor.
+# Результаты возвращаются в том же порядке, что и элементы
+def fan_out(fetch, items, executor=fetch_executor):
+    if not items:
+        return []
+    # Каждой задаче - своя копия контекста, чтобы замеры этапов
+    # попадали в учёт текущего запроса (metrics.request_timings)
+    contexts = [copy_context() for _ in items]
+    return list(executor.map(lambda c, item: c.run(fetch, item), contexts, items))
+
+
+# Параллельное получение прогнозов для всех городов маршрута
+def fetch_forecasts(cities):
+    return fan_out(fetch_city_forecast, cities)
+
+
+# То же, но результаты выдаются по мере готовности: (номер города, future)
+def iter_forecasts(cities):
+    if not cities:
+        return
+    futures = {
+        fetch_executor.submit(copy_context().run, fetch_city_forecast, city): index
+        for index, city in enumerate(cities)
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future
+    finally:
+        # Клиент отключился: ещё не начатые запросы не нужны
+        for future in futures:
+            future.cancel()
+
+
+def prepare_forecast_data(data):
+    forecast_data = []
+    for day in data:
+        forecast = {
+            "Date": day["Date"],
+            "Temperature": day["Temperature"]["Maximum"]["Value"],
+            "Wind Speed": day["Day"]["Wind"]["Speed"]["Value"],
+            "Precipitation Probability": day["Day"]["PrecipitationProbability"],
+        }
+        forecast_data.append(forecast)
+    return forecast_data
+
+
+# Версия прогноза: меняется только при изменении самих данных
+def forecast_version(data):
+    content = json.dumps(data, sort_keys=True).encode()
+    return hashlib.sha1(content).hexdigest()[:16]
+
+
+# Строка NDJSON с прогнозом (или ошибкой) для одного города
+def forecast_line(index, city, future):
+    try:
+        location, data = future.result()
+    except UpstreamError as error:
+        line = {"error": f"Сервис погоды недоступен: {error}", "status": 503}
+    else:
+        if not location:
+            line = {
+                "error": f"Не удалось найти данные для города: {city}",
+                "status": 400,
+            }
+        elif not data:
+            line = {
+                "error": f"Не удалось получить данные о погоде для города: {city}",
+                "status": 404,
+            }
+        else:
+            line = {"forecast": prepare_forecast_data(data)}
+    return json.dumps({"index": index, "name": city, **line}, ensure_ascii=False) + "\n"
+
+
+# Первый город, который не удалось найти или для которого нет прогноза:
+# (текст ошибки, код ответа) или None, если все прогнозы загружены
+def forecasts_error(cities, results):
+    for city, (location, data) in zip(cities, results):
+        if not location:
+            return f"Не удалось найти данные для города: {city}", 400
+        if not data:
+            return f"Не удалось получить данные о погоде для города: {city}", 404
+    return None
+
+
+# ETag ответа /get_data: меняется только вместе с прогнозами
+def forecasts_etag(cities, results):
+    versions = [
+        f"{city}:{location.key}:{forecast_version(data)}"
+        for city, (location, data) in zip(cities, results)
+    ]
+    return hashlib.sha1("\n".join(versions).encode()).hexdigest()
+
+
+# Сколько секунд ответ ещё свежий: до истечения TTL самого старого прогноза
+def forecasts_max_age(results):
+    ages = [forecast_cache.age(location.key) for location, _ in results]
+    age = max((age for age in ages if age is not None), default=0)
+    return max(int(forecast_cache.ttl - age), 0)
+
+
+def forecasts_body(cities, results):
+    return [
+        {"name": city, "forecast": prepare_forecast_data(data)}
+        for city, (location, data) in zip(cities, results)
+    ]
+
+
+# Прогноз по location key без поиска города
+def fetch_key_forecast(location_key):
+    data = get_forecast_data(location_key)
+    if data:
+        prefetcher.record(location_key)
+    return Location(location_key, None, None, None), data
+
+
+metrics.register_stats("location", location_resolver.stats)
+metrics.register_stats("forecast", forecast_cache.stats)
+metrics.register_stats(
+    "forecast", prefetcher.stats, metric="prefetch_events_total", label="cache"
+)
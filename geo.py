@@ -0,0 +1,168 @@
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+# Единичные векторы точек на сфере: массив формы (n, 3)
+def to_vectors(lats, lons):
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    cos_lats = np.cos(lats)
+    return np.stack(
+        [cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)], -1
+    )
+
+
+def from_vectors(vectors):
+    lats = np.degrees(np.arcsin(np.clip(vectors[..., 2], -1, 1)))
+    lons = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0]))
+    return lats, lons
+
+
+# Расстояние по дуге большого круга между парами точек, в км
+def haversine_km(lats1, lons1, lats2, lons2):
+    lats1, lons1, lats2, lons2 = (
+        np.radians(np.asarray(values, dtype=float))
+        for values in (lats1, lons1, lats2, lons2)
+    )
+    a = (
+        np.sin((lats2 - lats1) / 2) ** 2
+        + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Точки через каждые spacing_km вдоль маршрута по дугам большого круга
+# между соседними точками маршрута (все участки считаются сразу).
+# Если точек получается больше max_points, шаг увеличивается.
+# Возвращает широты, долготы и расстояния от начала маршрута в км
+def sample_route(lats, lons, spacing_km, max_points=None):
+    vectors = to_vectors(lats, lons)
+    if len(vectors) < 2 or spacing_km <= 0:
+        lats, lons = from_vectors(vectors)
+        return lats, lons, np.zeros(len(vectors))
+    starts, ends = vectors[:-1], vectors[1:]
+    angles = np.arccos(np.clip(np.einsum("ij,ij->i", starts, ends), -1, 1))
+    lengths = angles * EARTH_RADIUS_KM
+    total = lengths.sum()
+    if max_points and max_points > 1:
+        spacing_km = max(spacing_km, total / (max_points - 1))
+
+    # Число отрезков на каждом участке и номер участка для каждой точки
+    counts = np.maximum(np.ceil(lengths / spacing_km - 1e-9), 1).astype(int)
+    legs = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(legs)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = offsets / counts[legs]
+
+    # Сферическая интерполяция; на совпадающих точках - линейная
+    angle = angles[legs]
+    sin_angle = np.sin(angle)
+    near = sin_angle < 1e-12
+    safe = np.where(near, 1.0, sin_angle)
+    weight_start = np.where(near, 1 - fractions, np.sin((1 - fractions) * angle) / safe)
+    weight_end = np.where(near, fractions, np.sin(fractions * angle) / safe)
+    points = weight_start[:, None] * starts[legs] + weight_end[:, None] * ends[legs]
+    points = np.vstack([points, vectors[-1:]])
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+
+    distances = np.append(
+        (np.cumsum(lengths) - lengths)[legs] + fractions * lengths[legs], total
+    )
+    sample_lats, sample_lons = from_vectors(points)
+    return sample_lats, sample_lons, distances
+
+
+# Пространственный индекс городов: сетка из ячеек cell_deg x cell_deg
+# градусов. Ближайший город ищется только в ячейках вокруг точки,
+# расстояния до всех кандидатов всех точек считаются одним вызовом
+class LocationIndex:
+    def __init__(self, cell_deg=0.5):
+        self.cell_deg = cell_deg
+        self.lon_cells = int(math.ceil(360 / cell_deg))
+        self.locations = []
+        self._positions = {}
+        self._cells = defaultdict(list)
+        self._lock = threading.Lock()
+
+    # Добавление Location; повторное добавление того же key обновляет его
+    def add(self, location):
+        if location.lat is None or location.lon is None:
+            return
+        with self._lock:
+            position = self._positions.get(location.key)
+            if position is not None:
+                old = self.locations[position]
+                if (old.lat, old.lon) == (location.lat, location.lon):
+                    self.locations[position] = location
+                    return
+                self._cells[self._cell(old.lat, old.lon)].remove(position)
+                self.locations[position] = location
+            else:
+                position = len(self.locations)
+                self._positions[location.key] = position
+                self.locations.append(location)
+            self._cells[self._cell(location.lat, location.lon)].append(position)
+
+    def __len__(self):
+        return len(self.locations)
+
+    # Ближайший город не дальше radius_km для каждой точки (или None)
+    def nearest(self, lats, lons, radius_km):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        point_ids, candidates = [], []
+        with self._lock:
+            for point, (lat, lon) in enumerate(zip(lats, lons)):
+                for position in self._candidates(lat, lon, radius_km):
+                    point_ids.append(point)
+                    candidates.append(position)
+            found = [self.locations[position] for position in candidates]
+        result = [None] * len(lats)
+        if not candidates:
+            return result
+
+        point_ids = np.array(point_ids)
+        distances = haversine_km(
+            lats[point_ids],
+            lons[point_ids],
+            [location.lat for location in found],
+            [location.lon for location in found],
+        )
+        # Для каждой точки - кандидат с наименьшим расстоянием
+        order = np.lexsort((distances, point_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = point_ids[order][1:] != point_ids[order][:-1]
+        for index in order[first]:
+            if distances[index] <= radius_km:
+                result[point_ids[index]] = found[index]
+        return result
+
+    def _cell(self, lat, lon):
+        return (
+            int(math.floor(lat / self.cell_deg)),
+            int(math.floor(lon / self.cell_deg)) % self.lon_cells,
+        )
+
+    # Города из ячеек, которые пересекает круг радиуса radius_km
+    def _candidates(self, lat, lon, radius_km):
+        lat_delta = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + lat_delta, 90)))
+        lat_first = int(math.floor((lat - lat_delta) / self.cell_deg))
+        lat_last = int(math.floor((lat + lat_delta) / self.cell_deg))
+        if cos_lat * 180 * KM_PER_DEGREE <= radius_km:
+            lon_range = range(self.lon_cells)
+        else:
+            lon_delta = radius_km / (KM_PER_DEGREE * cos_lat)
+            lon_first = int(math.floor((lon - lon_delta) / self.cell_deg))
+            lon_last = int(math.floor((lon + lon_delta) / self.cell_deg))
+            lon_range = range(
+                lon_first, min(lon_last, lon_first + self.lon_cells - 1) + 1
+            )
+        for lat_cell in range(lat_first, lat_last + 1):
+            for lon_cell in lon_range:
+                yield from self._cells.get((lat_cell, lon_cell % self.lon_cells), ())
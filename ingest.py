@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Поля прогноза: колонка DataFrame -> путь к значению в ответе AccuWeather
+FORECAST_FIELDS = {
+    "Temperature": ("Temperature", "Maximum", "Value"),
+    "Min Temperature": ("Temperature", "Minimum", "Value"),
+    "Wind Speed": ("Day", "Wind", "Speed", "Value"),
+    "Wind Gust": ("Day", "WindGust", "Speed", "Value"),
+    "Precipitation Probability": ("Day", "PrecipitationProbability"),
+    "Night Wind Speed": ("Night", "Wind", "Speed", "Value"),
+    "Night Wind Gust": ("Night", "WindGust", "Speed", "Value"),
+    "Night Precipitation Probability": ("Night", "PrecipitationProbability"),
+}
+
+
+# Значение по пути в JSON; если поля нет (например, в другом виде
+# прогноза AccuWeather), возвращается NaN
+def field_value(day, path):
+    for key in path:
+        if not isinstance(day, dict):
+            return np.nan
+        day = day.get(key)
+    return np.nan if day is None else day
+
+
+# Смещение от UTC в минутах по концу строки Date ("+03:00", "Z" или пусто)
+def utc_offset(date):
+    suffix = date[19:]
+    if len(suffix) < 6:
+        return 0
+    minutes = int(suffix[1:3]) * 60 + int(suffix[4:6])
+    return -minutes if suffix[0] == "-" else minutes
+
+
+# Колонки прогноза одного города: даты в datetime64 (местное время
+# из поля Date), смещение этого времени от UTC в минутах и показатели
+# в float32, без промежуточных словарей по дням
+def forecast_columns(data):
+    count = len(data)
+    columns = {
+        "Date": np.array([day["Date"][:19] for day in data], dtype="datetime64[s]"),
+        "UTC Offset": np.fromiter(
+            (utc_offset(day["Date"]) for day in data), dtype=np.int32, count=count
+        ),
+    }
+    for column, path in FORECAST_FIELDS.items():
+        columns[column] = np.fromiter(
+            (field_value(day, path) for day in data), dtype=np.float32, count=count
+        )
+    return columns
+
+
+# Один DataFrame с прогнозами многих городов и категориальной колонкой City.
+# forecasts - список пар (город, DailyForecasts)
+def forecasts_frame(forecasts):
+    parts = [forecast_columns(data) for _, data in forecasts]
+    lengths = [len(data) for _, data in forecasts]
+    columns = {
+        "City": pd.Categorical(np.repeat([city for city, _ in forecasts], lengths))
+    }
+    dtypes = {"Date": "datetime64[s]", "UTC Offset": np.int32}
+    for column in ["Date", "UTC Offset", *FORECAST_FIELDS]:
+        if parts:
+            columns[column] = np.concatenate([part[column] for part in parts])
+        else:
+            columns[column] = np.array([], dtype=dtypes.get(column, np.float32))
+    return pd.DataFrame(columns)
+
+
+# Значения колонки для JSON: даты в ISO-формате, числа без хвостов float32,
+# отсутствующие значения (NaN) - None, то есть null в JSON
+def column_values(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime("%Y-%m-%dT%H:%M:%S").tolist()
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64).round(2)
+        return np.where(np.isnan(values), None, values).tolist()
+    return series.tolist()
+
+
+# Даты для JSON в том же виде, что и в ответе AccuWeather:
+# местное время со смещением от UTC ("2026-10-18T07:00:00+03:00")
+def date_values(frame):
+    offsets = frame["UTC Offset"].to_numpy()
+    signs = np.where(offsets < 0, "-", "+")
+    hours, minutes = np.divmod(np.abs(offsets), 60)
+    return [
+        f"{date}{sign}{hour:02d}:{minute:02d}"
+        for date, sign, hour, minute in zip(
+            column_values(frame["Date"]), signs, hours, minutes
+        )
+    ]
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from collections import namedtuple
+
+# Краткая запись о городе: всё, что нужно для прогноза и для карты
+Location = namedtuple("Location", ["key", "name", "lat", "lon"])
+
+
+# Ключ кэша для города: без учёта регистра и лишних пробелов
+def normalize_city_name(city_name, language):
+    return f"{language}:{' '.join(city_name.lower().split())}"
+
+
+# Преобразование ответа поиска AccuWeather в Location
+def location_from_search(result):
+    coords = result.get("GeoPosition") or {}
+    return Location(
+        result["Key"],
+        result.get("LocalizedName"),
+        coords.get("Latitude"),
+        coords.get("Longitude"),
+    )
+
+
+# Определение города по названию: один запрос поиска на город,
+# результат сохраняется в кэше
+class LocationResolver:
+    def __init__(self, search, cache, language):
+        self.search = search
+        self.cache = cache
+        self.language = language
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def resolve(self, city_name):
+        result = self._cached(city_name)
+        if result is None:
+            result = self.search(city_name)
+            if not result:
+                return None
+            self._store(city_name, result)
+        return self._location(city_name, result)
+
+    def _cached(self, city_name):
+        result = self.cache.get(normalize_city_name(city_name, self.language))
+        with self._lock:
+            self.stats["misses" if result is None else "hits"] += 1
+        return result
+
+    def _store(self, city_name, result):
+        self.cache.set(normalize_city_name(city_name, self.language), result)
+
+    def _location(self, city_name, result):
+        location = location_from_search(result)
+        if not location.name:
+            location = location._replace(name=city_name)
+        return location
+
+
+# То же для asyncio: search - корутина. Кэш (SQLite) читается
+# и пишется в потоке, чтобы не останавливать цикл событий
+class AsyncLocationResolver(LocationResolver):
+    async def resolve(self, city_name):
+        result = await asyncio.to_thread(self._cached, city_name)
+        if result is None:
+            result = await self.search(city_name)
+            if not result:
+                return None
+            await asyncio.to_thread(self._store, city_name, result)
+        return self._location(city_name, result)
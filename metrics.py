@@ -0,0 +1,146 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = "weather_"
+# Границы корзин гистограмм задержек, в секундах
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_stats = {}
+
+# Замеры этапов текущего запроса: список (этап, секунды) или None
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+# Увеличение счётчика
+def inc(name, value=1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+# Добавление значения в гистограмму
+def observe(name, value, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                "buckets": [0] * len(BUCKETS),
+                "sum": 0.0,
+                "count": 0,
+            }
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+# Словарь счётчиков (например, RefreshingCache.stats), который выводится
+# в /metrics как weather_{metric}{label=name,event=...}. По умолчанию -
+# события кэшей: weather_cache_events_total{cache=name}
+def register_stats(name, stats, metric="cache_events_total", label="cache"):
+    _stats[(metric, label, name)] = stats
+
+
+# Замер длительности этапа: гистограмма weather_stage_seconds
+# и, если идёт учёт запроса, запись в request_timings
+@contextmanager
+def timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("stage_seconds", elapsed, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+# То же в виде декоратора
+def timed(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Начало учёта этапов запроса (в текущем контексте)
+def start_request():
+    timings = []
+    request_timings.set(timings)
+    return timings
+
+
+# Сводка по этапам запроса: {этап: {"count": ..., "seconds": ...}}
+def summarize(timings):
+    summary = {}
+    for stage, elapsed in timings:
+        item = summary.setdefault(stage, {"count": 0, "seconds": 0.0})
+        item["count"] += 1
+        item["seconds"] = round(item["seconds"] + elapsed, 6)
+    return summary
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    text = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + text + "}"
+
+
+# Все метрики в текстовом формате Prometheus
+def render():
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: {**value, "buckets": list(value["buckets"])}
+            for key, value in _histograms.items()
+        }
+
+    declared = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+    for (name, label, source), stats in sorted(_stats.items()):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+        for event, value in sorted(stats.items()):
+            labels = _format_labels(((label, source), ("event", event)))
+            lines.append(f"{PREFIX}{name}{labels} {value}")
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            bucket_labels = _format_labels(labels + (("le", bound),))
+            lines.append(f"{PREFIX}{name}_bucket{bucket_labels} {count}")
+        inf_labels = _format_labels(labels + (("le", "+Inf"),))
+        lines.append(f"{PREFIX}{name}_bucket{inf_labels} {histogram['count']}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(
+            f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}"
+        )
+    return "\n".join(lines) + "\n"
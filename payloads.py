@@ -0,0 +1,111 @@
+import gzip
+import importlib.util
+import json
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+# Необязательные зависимости: без них доступны только JSON и gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# pyarrow тяжёлый, поэтому загружается только для первого ответа в Arrow
+HAS_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+STREAM_TYPE = "application/x-ndjson"
+
+# Ответы меньше этого размера не сжимаются
+COMPRESS_MIN_SIZE = 1024
+# Значения Content-Encoding, которые может вернуть compress
+ENCODINGS = ("br", "gzip")
+
+
+# Форматы ответа, доступные с установленными библиотеками
+def available_formats():
+    formats = [JSON_TYPE]
+    if msgpack is not None:
+        formats.append(MSGPACK_TYPE)
+    if HAS_ARROW:
+        formats.append(ARROW_TYPE)
+    return formats
+
+
+# Выбор формата по заголовку Accept (по умолчанию JSON)
+def negotiate_format(accept_mimetypes):
+    return accept_mimetypes.best_match(available_formats(), default=JSON_TYPE)
+
+
+# Сериализация колоночного ответа. payload - словарь для JSON/MessagePack,
+# frame - тот же прогноз в виде DataFrame для Arrow
+def encode_batch(payload, frame, mimetype):
+    if mimetype == MSGPACK_TYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+    if mimetype == ARROW_TYPE:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        metadata = {
+            key: json.dumps(value, ensure_ascii=False)
+            for key, value in payload.items()
+            if key != "columns"
+        }
+        table = table.replace_schema_metadata(metadata)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    # NaN не входит в JSON: column_values заменяет его на None
+    return json.dumps(
+        payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+    ).encode()
+
+
+# Сжатие тела ответа по Accept-Encoding: br (если установлен brotli)
+# или gzip. Возвращает тело и значение Content-Encoding (или None)
+def compress(body, accept_encodings):
+    if len(body) < COMPRESS_MIN_SIZE:
+        return body, None
+    if brotli is not None and "br" in accept_encodings:
+        return brotli.compress(body), "br"
+    if "gzip" in accept_encodings:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+
+# ETag тела с учётом сжатия: у сжатого и несжатого тела разные байты,
+# поэтому и сильные ETag у них должны быть разными
+def encoded_etag(etag, encoding):
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+# Все ETag, которые могли быть выданы для ответа с ETag etag
+def etag_variants(etag):
+    return [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS]
+
+
+# Потоковый режим: параметр stream=1 или NDJSON - лучший тип в Accept
+# (с учётом q), одинаково для api.py и async_api.py
+def wants_stream(stream, accept):
+    if stream in ("1", "true"):
+        return True
+    return parse_accept_header(accept, MIMEAccept).best == STREAM_TYPE
+
+
+# ETag из etag_variants(etag), совпавший с If-None-Match при слабом
+# сравнении (или None): для него отвечается 304 без тела
+def matched_etag(etag, if_none_match):
+    etags = parse_etags(if_none_match)
+    for tag in etag_variants(etag):
+        if etags.contains_weak(tag):
+            return tag
+    return None
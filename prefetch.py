@@ -0,0 +1,156 @@
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from upstream import RateLimiter, UpstreamError
+
+logger = logging.getLogger(__name__)
+
+
+# Фоновое обновление популярных прогнозов. Для каждого location key
+# ведётся счётчик запросов, который затухает вдвое за half_life секунд.
+# Раз в interval секунд прогнозы top_n самых популярных городов, срок
+# которых истекает в ближайшие lead секунд, загружаются заново, но не
+# больше доли quota_share от лимитов AccuWeather. Отслеживается не больше
+# max_keys городов: при переполнении наименее популярные забываются
+class PrefetchScheduler:
+    def __init__(
+        self,
+        cache,
+        limiter=None,
+        top_n=50,
+        half_life=3600,
+        interval=60,
+        lead=120,
+        quota_share=0.2,
+        pacer=None,
+        max_keys=10000,
+    ):
+        self.cache = cache
+        self.limiter = limiter
+        self.top_n = top_n
+        self.half_life = half_life
+        self.interval = interval
+        self.lead = lead
+        self.quota_share = quota_share
+        self.max_keys = max_keys
+        # Обновления идут не быстрее доли quota_share от лимита AccuWeather,
+        # чтобы проход не занимал весь лимит и не задерживал запросы
+        # пользователей. Бюджет прохода рассчитан на interval секунд.
+        # pacer можно передать готовым (общим для нескольких процессов)
+        self.pacer = pacer
+        if pacer is None and limiter is not None and limiter.rate and quota_share > 0:
+            self.pacer = RateLimiter(limiter.rate * quota_share, max_wait=interval)
+        self.stats = {"prefetched": 0, "skipped": 0, "errors": 0}
+        self._scores = {}
+        self._day = None
+        self._used_today = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Учёт полученного прогноза для города. Без фонового обновления
+    # (top_n = 0) популярность не отслеживается
+    def record(self, key):
+        if self.top_n <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            score, updated = self._scores.get(key, (0.0, now))
+            self._scores[key] = (self._decay(score, now - updated) + 1, now)
+            if len(self._scores) > self.max_keys:
+                # Сразу до 90%, чтобы не сортировать счётчики на каждом запросе
+                self._prune(now, int(self.max_keys * 0.9))
+
+    # Самые популярные города по текущему значению счётчика
+    def hot_keys(self):
+        now = time.time()
+        with self._lock:
+            scores = self._prune(now, self.max_keys)
+        hot = sorted(scores, key=scores.get, reverse=True)
+        return hot[: self.top_n]
+
+    # Текущие значения счётчиков; почти забытые города и наименее
+    # популярные сверх limit больше не отслеживаются
+    def _prune(self, now, limit):
+        scores = {
+            key: self._decay(score, now - updated)
+            for key, (score, updated) in self._scores.items()
+        }
+        scores = {key: score for key, score in scores.items() if score >= 0.01}
+        if len(scores) > limit:
+            kept = sorted(scores, key=scores.get, reverse=True)[:limit]
+            scores = {key: scores[key] for key in kept}
+        for key in list(self._scores):
+            if key not in scores:
+                del self._scores[key]
+        return scores
+
+    def run_once(self):
+        budget = self._budget()
+        for key in self.hot_keys():
+            if self._stop.is_set():
+                return
+            age = self.cache.age(key)
+            if age is not None and age < self.cache.ttl - self.lead:
+                continue
+            if budget <= 0:
+                self._count("skipped")
+                continue
+            budget -= 1
+            self._used_today += 1
+            if self.pacer is not None:
+                try:
+                    self.pacer.acquire()
+                except UpstreamError:
+                    # Доля лимита израсходована, в том числе другими процессами
+                    self._count("skipped")
+                    return
+            try:
+                self.cache.refresh(key)
+                self._count("prefetched")
+            except Exception:
+                logger.exception("Не удалось обновить прогноз %s", key)
+                self._count("errors")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="forecast-prefetch", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Ошибка фонового обновления прогнозов")
+
+    # Сколько запросов к AccuWeather можно сделать за один проход
+    def _budget(self):
+        if self.limiter is None:
+            return self.top_n
+        budget = self.top_n
+        if self.limiter.rate:
+            budget = math.floor(self.limiter.rate * self.interval * self.quota_share)
+        if self.limiter.daily_quota:
+            today = datetime.now(timezone.utc).date()
+            if today != self._day:
+                self._day = today
+                self._used_today = 0
+            daily = math.floor(self.limiter.daily_quota * self.quota_share)
+            budget = min(budget, daily - self._used_today)
+        return max(budget, 0)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _decay(self, score, elapsed):
+        return score * 0.5 ** (elapsed / self.half_life)
@@ -0,0 +1,127 @@
+import threading
+import time
+from os import getenv
+
+import metrics
+from forecasts import (
+    CACHE_SYNC_INTERVAL,
+    bulk_executor,
+    fan_out,
+    get_forecast_data,
+    location_cache,
+)
+from geo import LocationIndex, sample_route
+from locations import location_from_search
+from upstream import UpstreamError
+
+# Шаг точек погоды вдоль маршрута, в км (0 - только города маршрута)
+ROUTE_SAMPLE_SPACING_KM = float(getenv("ROUTE_SAMPLE_SPACING_KM", "50"))
+# Насколько далеко от точки может быть город, чей прогноз ей назначается
+ROUTE_SAMPLE_RADIUS_KM = float(getenv("ROUTE_SAMPLE_RADIUS_KM", "25"))
+# Максимальное число точек на маршрут
+ROUTE_SAMPLE_MAX_POINTS = int(getenv("ROUTE_SAMPLE_MAX_POINTS", "100"))
+
+
+# Погода вдоль маршрута. Точки через равные расстояния привязываются
+# к ближайшим уже известным городам из кэша городов (без запросов
+# поиска к AccuWeather), прогнозы загружаются один раз на город.
+# Индекс городов дополняется записями, которые появились в кэше
+# (в том числе из других процессов), не чаще раза в sync_interval секунд.
+# Если прогноз для города получить не удалось, пропускаются только его точки
+class RouteSampler:
+    def __init__(
+        self,
+        cache,
+        get_forecast,
+        spacing_km=50,
+        radius_km=25,
+        max_points=100,
+        sync_interval=1.0,
+    ):
+        self.cache = cache
+        self.get_forecast = get_forecast
+        self.spacing_km = spacing_km
+        self.radius_km = radius_km
+        self.max_points = max_points
+        self.sync_interval = sync_interval
+        self.index = LocationIndex()
+        self.stats = {"samples": 0, "snapped": 0, "missed": 0, "failed": 0}
+        self._synced = None
+        self._lock = threading.Lock()
+
+    # Точки маршрута по списку Location: словари с координатами,
+    # расстоянием от начала, ближайшим городом и его прогнозом (DailyForecasts)
+    @metrics.timed("sample_route")
+    def sample(self, locations):
+        points = [item for item in locations if None not in (item.lat, item.lon)]
+        if len(points) < 2 or self.spacing_km <= 0:
+            return []
+        for location in points:
+            self.index.add(location)
+        self.sync()
+
+        lats, lons, distances = sample_route(
+            [item.lat for item in points],
+            [item.lon for item in points],
+            self.spacing_km,
+            self.max_points,
+        )
+        nearest = self.index.nearest(lats, lons, self.radius_km)
+        snapped = sum(location is not None for location in nearest)
+        with self._lock:
+            self.stats["samples"] += len(nearest)
+            self.stats["snapped"] += snapped
+            self.stats["missed"] += len(nearest) - snapped
+
+        keys = list(dict.fromkeys(item.key for item in nearest if item is not None))
+        results = fan_out(self.try_forecast, keys, executor=bulk_executor)
+        forecasts = dict(zip(keys, results))
+        samples = []
+        for lat, lon, distance, location in zip(lats, lons, distances, nearest):
+            if location is None or not forecasts.get(location.key):
+                continue
+            samples.append(
+                {
+                    "lat": float(lat),
+                    "lon": float(lon),
+                    "distance": float(distance),
+                    "location": location,
+                    "forecast": forecasts[location.key],
+                }
+            )
+        return samples
+
+    # Прогноз города или None, если AccuWeather вернул ошибку
+    def try_forecast(self, location_key):
+        try:
+            return self.get_forecast(location_key)
+        except UpstreamError:
+            with self._lock:
+                self.stats["failed"] += 1
+            return None
+
+    # Добавление в индекс городов, записанных в кэш с прошлой синхронизации
+    def sync(self):
+        now = time.time()
+        with self._lock:
+            if self._synced is not None and now - self._synced < self.sync_interval:
+                return
+            since, self._synced = self._synced, now
+        # Небольшой запас на случай неточно синхронизированных часов записи
+        items = self.cache.items(None if since is None else since - 1)
+        for _, result in items:
+            self.index.add(location_from_search(result))
+
+
+route_sampler = RouteSampler(
+    location_cache,
+    get_forecast_data,
+    spacing_km=ROUTE_SAMPLE_SPACING_KM,
+    radius_km=ROUTE_SAMPLE_RADIUS_KM,
+    max_points=ROUTE_SAMPLE_MAX_POINTS,
+    sync_interval=CACHE_SYNC_INTERVAL,
+)
+
+metrics.register_stats(
+    "route", route_sampler.stats, metric="route_sample_points_total", label="sampler"
+)
@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import json
+import mmap
+import os
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+# Блокировка сжатия между процессами (на Windows её нет)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from upstream import UpstreamError
+
+# record - ответы AccuWeather сохраняются на диск,
+# replay - запросы не отправляются, ответы берутся только с диска,
+# fallback - ответы сохраняются, а при недоступности AccuWeather
+# вместо ошибки отдаётся последний сохранённый ответ
+SNAPSHOT_MODES = ("record", "replay", "fallback")
+
+
+# Ключ сохранённого ответа: путь и параметры запроса без API-ключа,
+# название города без учёта регистра и лишних пробелов
+def snapshot_key(path, params=None):
+    items = []
+    for name, value in sorted((params or {}).items()):
+        if name == "apikey":
+            continue
+        value = str(value)
+        if name == "q":
+            value = " ".join(value.lower().split())
+        items.append((name, value))
+    return f"{path}?{urlencode(items)}" if items else path
+
+
+# Сохранённый ответ с тем же интерфейсом, что и у requests.Response,
+# который используется в app.py
+class SnapshotResponse:
+    def __init__(self, status_code, content, stored):
+        self.status_code = status_code
+        self.content = content
+        self.stored = stored
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Хранилище ответов в каталоге path: data.bin - сжатые zlib тела ответов
+# подряд, index.jsonl - по строке на ответ (ключ, смещение, размер,
+# контрольная сумма тела). Индекс держится в памяти, data.bin читается
+# через mmap. Записи только добавляются в конец файлов, поэтому писать
+# могут несколько процессов сразу; новые записи других процессов
+# подхватываются при промахе. Ответ, не изменившийся с прошлой записи,
+# не дописывается. Когда data.bin становится больше max_bytes, файлы
+# переписываются только с последними версиями ответов, а самые старые
+# ответы удаляются, пока не останется половина max_bytes
+class SnapshotStore:
+    def __init__(self, path, max_bytes=None):
+        os.makedirs(path, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.data_path = os.path.join(path, "data.bin")
+        self.index_path = os.path.join(path, "index.jsonl")
+        self.lock_path = os.path.join(path, "compact.lock")
+        for file_path in (self.data_path, self.index_path):
+            open(file_path, "ab").close()
+        self._index = {}
+        self._index_position = 0
+        self._index_inode = None
+        self._map = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._read_index()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self._read_index()
+                entry = self._index.get(key)
+            if entry is None:
+                return None
+            content = self._read(entry)
+            if content is None:
+                # Файлы могли быть переписаны другим процессом
+                self._read_index()
+                self._remap()
+                entry = self._index.get(key)
+                content = entry and self._read(entry)
+            if content is None:
+                return None
+        return SnapshotResponse(entry["status"], content, entry["stored"])
+
+    # Возвращает False, если такой же ответ уже сохранён
+    def put(self, key, status, content):
+        checksum = zlib.crc32(content)
+        with self._lock:
+            self._read_index()
+            current = self._index.get(key)
+        if (
+            current is not None
+            and current["crc"] == checksum
+            and current["status"] == status
+        ):
+            return False
+        data = zlib.compress(content)
+        offset = self._append(self.data_path, data)
+        entry = {
+            "key": key,
+            "offset": offset,
+            "size": len(data),
+            "status": status,
+            "crc": checksum,
+            "stored": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        self._append(self.index_path, line.encode())
+        with self._lock:
+            self._index[key] = entry
+        if self.max_bytes and offset + len(data) > self.max_bytes:
+            self.compact()
+        return True
+
+    def __len__(self):
+        with self._lock:
+            self._read_index()
+            return len(self._index)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    # Перезапись файлов только с действующими записями. Новые файлы
+    # подменяют старые через os.replace, поэтому читатели других процессов
+    # видят либо старые, либо новые файлы; записи, сделанные другими
+    # процессами во время сжатия, могут потеряться
+    def compact(self):
+        with self._compact_lock(), self._lock:
+            self._read_index()
+            if os.path.getsize(self.data_path) <= (self.max_bytes or 0):
+                return
+            self._remap()
+            entries = sorted(
+                self._index.values(), key=lambda item: item["stored"], reverse=True
+            )
+            limit = self.max_bytes // 2 if self.max_bytes else None
+            data_tmp = self.data_path + ".tmp"
+            index_tmp = self.index_path + ".tmp"
+            kept = []
+            size = 0
+            with open(data_tmp, "wb") as data_file:
+                for entry in entries:
+                    if limit is not None and size + entry["size"] > limit:
+                        continue
+                    data = self._map[entry["offset"] : entry["offset"] + entry["size"]]
+                    data_file.write(data)
+                    kept.append({**entry, "offset": size})
+                    size += entry["size"]
+            kept.reverse()
+            with open(index_tmp, "wb") as index_file:
+                for entry in kept:
+                    line = json.dumps(entry, ensure_ascii=False) + "\n"
+                    index_file.write(line.encode())
+            os.replace(data_tmp, self.data_path)
+            os.replace(index_tmp, self.index_path)
+            self._read_index()
+            self._remap()
+
+    # Запись одним вызовом write в режиме O_APPEND: данные не смешиваются
+    # с записями других процессов. Возвращает смещение записанных данных
+    def _append(self, path, data):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+        try:
+            os.write(fd, data)
+            return os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+        finally:
+            os.close(fd)
+
+    # Тело ответа или None, если данные не совпадают с записью индекса
+    def _read(self, entry):
+        end = entry["offset"] + entry["size"]
+        if self._map is None or len(self._map) < end:
+            self._remap()
+        if len(self._map) < end:
+            return None
+        try:
+            content = zlib.decompress(self._map[entry["offset"] : end])
+        except zlib.error:
+            return None
+        if zlib.crc32(content) != entry["crc"]:
+            return None
+        return content
+
+    # Чтение строк индекса, добавленных с прошлого раза. Последняя строка
+    # может быть дописана не до конца, тогда она читается в следующий раз.
+    # Если файл индекса заменён при сжатии, он читается заново
+    def _read_index(self):
+        with open(self.index_path, "rb") as file:
+            inode = os.fstat(file.fileno()).st_ino
+            if inode != self._index_inode:
+                self._index = {}
+                self._index_position = 0
+                self._index_inode = inode
+            file.seek(self._index_position)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_position += len(line)
+                entry = json.loads(line)
+                self._index[entry["key"]] = entry
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        with open(self.data_path, "rb") as file:
+            if os.fstat(file.fileno()).st_size:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = b""
+
+    # Сжатие выполняет только один процесс
+    @contextlib.contextmanager
+    def _compact_lock(self):
+        with open(self.lock_path, "ab") as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+# Клиент AccuWeather с записью и воспроизведением ответов. Оборачивает
+# UpstreamClient и повторяет его интерфейс get(path, params)
+class SnapshotClient:
+    def __init__(self, client, store, mode):
+        if mode not in SNAPSHOT_MODES:
+            raise ValueError(f"Неизвестный режим записи ответов: {mode}")
+        self.client = client
+        self.store = store
+        self.mode = mode
+        self.limiter = client.limiter
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "recorded": 0,
+            "unchanged": 0,
+            "fallbacks": 0,
+        }
+        self._lock = threading.Lock()
+
+    def get(self, path, params=None):
+        key = snapshot_key(path, params)
+        if self.mode == "replay":
+            return self._replay(key)
+        try:
+            response = self.client.get(path, params)
+        except UpstreamError as error:
+            return self._fallback(key, error)
+        return self._record(key, response)
+
+    def _replay(self, key):
+        response = self.store.get(key)
+        if response is None:
+            self._count("misses")
+            raise UpstreamError(f"Нет сохранённого ответа AccuWeather: {key}")
+        self._count("hits")
+        return response
+
+    def _fallback(self, key, error):
+        if self.mode != "fallback":
+            raise error
+        response = self.store.get(key)
+        if response is None:
+            self._count("misses")
+            raise error
+        self._count("fallbacks")
+        return response
+
+    # Сохраняются только успешные ответы, ошибки 4xx не воспроизводятся
+    def _record(self, key, response):
+        if response.status_code == 200:
+            if self.store.put(key, response.status_code, response.content):
+                self._count("recorded")
+            else:
+                self._count("unchanged")
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+# То же для AsyncUpstreamClient. Чтение и запись файлов хранилища
+# выполняются в потоке, а не в цикле событий
+class AsyncSnapshotClient(SnapshotClient):
+    async def get(self, path, params=None):
+        key = snapshot_key(path, params)
+        if self.mode == "replay":
+            return await asyncio.to_thread(self._replay, key)
+        try:
+            response = await self.client.get(path, params)
+        except UpstreamError as error:
+            return await asyncio.to_thread(self._fallback, key, error)
+        return await asyncio.to_thread(self._record, key, response)
+
+    async def start(self):
+        await self.client.start()
+
+    async def close(self):
+        await self.client.close()
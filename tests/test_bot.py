@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot import Outbox, split_text
+
+
+def test_split_text_short():
+    assert split_text("привет", limit=10) == ["привет"]
+    assert split_text("", limit=10) == []
+
+
+def test_split_text_by_lines():
+    text = "aaaa\nbbbb\ncccc\n"
+    assert split_text(text, limit=10) == ["aaaa\nbbbb\n", "cccc\n"]
+
+
+def test_split_text_long_line():
+    text = "ab\n" + "x" * 25 + "\ncd"
+    chunks = split_text(text, limit=10)
+    assert chunks == ["ab\n", "x" * 10, "x" * 10, "xxxxx\ncd"]
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 10 for chunk in chunks)
+
+
+class Recorder:
+    def __init__(self, fail=0, retry_after=1):
+        self.sent = []
+        self.fail = fail
+        self.retry_after = retry_after
+
+    async def __call__(self, text):
+        if self.fail:
+            self.fail -= 1
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=1, text=text),
+                message="Too Many Requests",
+                retry_after=self.retry_after,
+            )
+        self.sent.append((text, time.monotonic()))
+
+
+def test_outbox_merges_queued_messages():
+    async def run():
+        outbox = Outbox(0, 0, 0, limit=10)
+        send = Recorder()
+        for text in ("a", "b", "cccc", "dddddd"):
+            outbox.send(1, text, send)
+        await outbox.flush(1)
+        return [text for text, _ in send.sent]
+
+    # Пока чат ждёт очереди, короткие сообщения объединяются до limit
+    assert asyncio.run(run()) == ["a\n\nb\n\ncccc", "dddddd"]
+
+
+def test_outbox_splits_long_message():
+    async def run():
+        outbox = Outbox(0, 0, 0, limit=10)
+        send = Recorder()
+        outbox.send(1, "x" * 25, send)
+        await outbox.flush(1)
+        return [text for text, _ in send.sent]
+
+    assert asyncio.run(run()) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_outbox_retries_after_flood_limit():
+    async def run():
+        outbox = Outbox(0, 0, 0)
+        send = Recorder(fail=1, retry_after=0.2)
+        started = time.monotonic()
+        outbox.send(1, "a", send)
+        await outbox.flush(1)
+        return send.sent, time.monotonic() - started
+
+    sent, elapsed = asyncio.run(run())
+    assert [text for text, _ in sent] == ["a"]
+    assert elapsed >= 0.2
+
+
+def test_outbox_pause_is_per_chat():
+    async def run():
+        outbox = Outbox(0, 0, 0)
+        flooded = Recorder(fail=1, retry_after=0.5)
+        other = Recorder()
+        started = time.monotonic()
+        outbox.send(-100, "a", flooded)
+        await asyncio.sleep(0.01)
+        outbox.send(2, "b", other)
+        await outbox.flush(2)
+        await outbox.flush(-100)
+        return other.sent[0][1] - started, flooded.sent[0][1] - started
+
+    other_delay, flooded_delay = asyncio.run(run())
+    # Ответ 429 в одной группе не задерживает другие чаты
+    assert other_delay < 0.2
+    assert flooded_delay >= 0.5
+
+
+def test_outbox_chat_rate():
+    async def run():
+        outbox = Outbox(chat_rate=4, group_rate=0, global_rate=0, limit=1)
+        send = Recorder()
+        for text in "abcdef":
+            outbox.send(1, text, send)
+        await outbox.flush(1)
+        return [at for _, at in send.sent]
+
+    sent = asyncio.run(run())
+    assert len(sent) == 6
+    # Первые 4 сообщения уходят сразу, остальные - не чаще 4 в секунду
+    assert sent[3] - sent[0] < 0.1
+    assert sent[-1] - sent[0] >= 0.45
@@ -0,0 +1,123 @@
+import time
+
+from cache import LRUCache, PersistentCache, SQLiteCache
+
+
+# LRUCache, запоминающий удалённые ключи
+class TrackingLRUCache(LRUCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deleted = []
+
+    def delete(self, key):
+        self.deleted.append(key)
+        super().delete(key)
+
+
+def make_cache(path, **kwargs):
+    return PersistentCache(path, memory=TrackingLRUCache(), sync_interval=0, **kwargs)
+
+
+def count(cache):
+    return cache._conn.execute(f"SELECT COUNT(*) FROM {cache.table}").fetchone()[0]
+
+
+def test_sqlite_cache_round_trip(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    cache.set(("route", 1), {"cities": ["Москва"]})
+    assert cache.get(("route", 1)) == {"cities": ["Москва"]}
+    cache.delete(("route", 1))
+    assert cache.get(("route", 1)) is None
+
+
+def test_sqlite_cache_expired_entry(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3")
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert count(cache) == 0
+
+
+def test_sweep_trims_least_recently_used(tmp_path):
+    cache = SQLiteCache(
+        tmp_path / "cache.sqlite3", max_entries=100, sweep_interval=10, touch_interval=0
+    )
+    cache.set("hot", 0)
+    for index in range(300):
+        cache.set(index, index)
+        time.sleep(0.0001)
+        # Запись, к которой обращаются, не вытесняется
+        assert cache.get("hot") == 0
+    assert count(cache) <= 100 + cache.sweep_interval
+    assert cache.get(299) == 299
+    assert cache.get(0) is None
+
+
+def test_sweep_trims_to_ninety_percent(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3", max_entries=100, sweep_interval=10)
+    for index in range(110):
+        cache.set(index, index)
+    assert count(cache) == 90
+
+
+def test_sweep_purges_expired_entries(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3", sweep_interval=10)
+    for index in range(5):
+        cache.set(f"old{index}", index, ttl=0.01)
+    time.sleep(0.02)
+    for index in range(5):
+        cache.set(index, index)
+    # Истёкшие записи удалены без обращения к ним
+    assert count(cache) == 5
+
+
+def test_no_sweep_between_intervals(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3", max_entries=10, sweep_interval=50)
+    for index in range(40):
+        cache.set(index, index)
+    assert count(cache) == 40
+
+
+def test_persistent_cache_sees_other_instance_writes(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    first = make_cache(path)
+    second = make_cache(path)
+    first.set("a", 1)
+    assert second.get("a") == 1
+    first.set("a", 2)
+    # Копия в памяти второго экземпляра сброшена по таблице изменений
+    assert second.get("a") == 2
+    first.delete("a")
+    assert second.get("a") is None
+
+
+def test_persistent_cache_skips_own_writes(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = make_cache(path)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    assert cache.get("b") == 2
+    assert cache.memory.deleted == []
+
+
+def test_persistent_cache_clear_reaches_other_instances(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    first = make_cache(path)
+    second = make_cache(path)
+    first.set("a", 1)
+    assert second.get("a") == 1
+    first.clear()
+    assert second.get("a") is None
+    assert len(second.memory) == 0
+
+
+def test_persistent_cache_sync_interval(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    first = make_cache(path)
+    second = PersistentCache(path, sync_interval=3600)
+    first.set("a", 1)
+    assert second.get("a") == 1
+    first.set("a", 2)
+    # До следующей синхронизации отдаётся копия из памяти
+    assert second.get("a") == 1
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from geo import LocationIndex, haversine_km, sample_route
+from locations import Location
+
+
+def test_haversine_km():
+    # Москва - Санкт-Петербург
+    distance = haversine_km(55.7558, 37.6173, 59.9343, 30.3351)
+    assert distance == pytest.approx(634, abs=2)
+
+
+def test_sample_route_spacing():
+    lats, lons, distances = sample_route([0, 0], [0, 10], spacing_km=100)
+    total = haversine_km(0, 0, 0, 10)
+    assert len(lats) == int(np.ceil(total / 100)) + 1
+    assert (lats[0], lons[0]) == pytest.approx((0, 0))
+    assert (lats[-1], lons[-1]) == pytest.approx((0, 10))
+    assert distances[-1] == pytest.approx(total)
+    steps = haversine_km(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    assert np.all(steps <= 100 + 1e-6)
+    assert np.diff(distances) == pytest.approx(steps)
+
+
+def test_sample_route_zero_length_leg():
+    lats, lons, distances = sample_route([10, 10, 10], [20, 20, 21], spacing_km=50)
+    assert np.all(np.isfinite(lats)) and np.all(np.isfinite(lons))
+    # Участок нулевой длины даёт одну точку в начале маршрута
+    assert (lats[0], lons[0]) == pytest.approx((10, 20))
+    assert (lats[1], lons[1]) == pytest.approx((10, 20))
+    assert distances[1] == 0
+    assert (lats[-1], lons[-1]) == pytest.approx((10, 21))
+    assert np.all(np.diff(distances) >= 0)
+
+
+def test_sample_route_single_point():
+    lats, lons, distances = sample_route([10], [20], spacing_km=50)
+    assert (list(lats), list(lons), list(distances)) == pytest.approx(
+        ([10], [20], [0])
+    )
+
+
+def test_sample_route_crosses_antimeridian():
+    lats, lons, distances = sample_route([60, 60], [179, -179], spacing_km=20)
+    total = haversine_km(60, 179, 60, -179)
+    # Маршрут идёт через 180-й меридиан, а не вокруг Земли
+    assert distances[-1] == pytest.approx(total)
+    assert total < 150
+    assert np.all(np.abs(lons) >= 178.9)
+
+
+def test_sample_route_max_points():
+    lats, _, distances = sample_route([0, 0], [0, 90], spacing_km=10, max_points=20)
+    assert len(lats) <= 20
+    assert distances[-1] == pytest.approx(haversine_km(0, 0, 0, 90))
+
+
+def test_nearest_within_radius():
+    index = LocationIndex()
+    index.add(Location("1", "Москва", 55.7558, 37.6173))
+    index.add(Location("2", "Тверь", 56.8587, 35.9176))
+    nearest = index.nearest([55.8, 56.8, 0], [37.6, 35.9, 0], radius_km=25)
+    assert [item and item.key for item in nearest] == ["1", "2", None]
+
+
+def test_nearest_picks_closest_candidate():
+    index = LocationIndex(cell_deg=0.1)
+    index.add(Location("far", None, 10.2, 20.0))
+    index.add(Location("near", None, 10.05, 20.0))
+    assert index.nearest([10.0], [20.0], radius_km=50)[0].key == "near"
+
+
+def test_nearest_across_antimeridian():
+    index = LocationIndex()
+    index.add(Location("east", None, 65.0, 179.9))
+    nearest = index.nearest([65.0, 65.0], [-179.95, 0], radius_km=25)
+    assert nearest[0].key == "east"
+    assert nearest[1] is None
+
+
+def test_nearest_near_pole():
+    index = LocationIndex()
+    index.add(Location("pole", None, 89.9, 100.0))
+    assert index.nearest([89.95], [-80.0], radius_km=25)[0].key == "pole"
+
+
+def test_add_moves_location():
+    index = LocationIndex()
+    index.add(Location("1", "Старое место", 10.0, 20.0))
+    index.add(Location("1", "Новое место", 40.0, 50.0))
+    index.add(Location("2", "Без координат", None, None))
+    assert len(index) == 1
+    assert index.nearest([10.0], [20.0], radius_km=25) == [None]
+    assert index.nearest([40.0], [50.0], radius_km=25)[0].name == "Новое место"
@@ -0,0 +1,158 @@
+import os
+import zlib
+
+import pytest
+
+from snapshots import SnapshotClient, SnapshotStore, snapshot_key
+from upstream import UpstreamError
+
+
+def body(index, size=1000):
+    # Случайные байты почти не сжимаются: размер записи предсказуем
+    return str(index).encode() + os.urandom(size)
+
+
+def test_put_and_get(tmp_path):
+    store = SnapshotStore(tmp_path)
+    content = b'{"Key": "294021"}'
+    assert store.put("/a", 200, content)
+    response = store.get("/a")
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.json() == {"Key": "294021"}
+    assert store.get("/missing") is None
+
+
+def test_unchanged_response_is_not_appended(tmp_path):
+    store = SnapshotStore(tmp_path)
+    assert store.put("/a", 200, b"1")
+    size = os.path.getsize(store.data_path)
+    assert not store.put("/a", 200, b"1")
+    assert os.path.getsize(store.data_path) == size
+    assert store.put("/a", 200, b"2")
+    assert store.get("/a").content == b"2"
+
+
+def test_other_store_sees_new_records(tmp_path):
+    reader = SnapshotStore(tmp_path)
+    writer = SnapshotStore(tmp_path)
+    writer.put("/a", 200, b"1")
+    assert reader.get("/a").content == b"1"
+    assert len(reader) == 1
+
+
+def test_incomplete_index_line_is_read_later(tmp_path):
+    store = SnapshotStore(tmp_path)
+    store.put("/a", 200, b"1")
+    with open(store.index_path, "rb") as file:
+        line = file.read()
+    with open(store.index_path, "wb") as file:
+        file.write(line[:-10])
+    reader = SnapshotStore(tmp_path)
+    assert reader.get("/a") is None
+    with open(store.index_path, "ab") as file:
+        file.write(line[-10:])
+    assert reader.get("/a").content == b"1"
+
+
+def test_compact_keeps_latest_records(tmp_path):
+    store = SnapshotStore(tmp_path, max_bytes=10_000)
+    contents = {}
+    for index in range(30):
+        key = f"/{index % 12}"
+        contents[key] = body(index)
+        store.put(key, 200, contents[key])
+    assert os.path.getsize(store.data_path) <= 10_000
+    kept = [key for key in contents if store.get(key) is not None]
+    assert kept
+    # Сохраняются самые новые ответы и только последние их версии
+    assert "/5" in kept
+    for key in kept:
+        assert store.get(key).content == contents[key]
+
+
+def test_reader_follows_compaction_by_other_store(tmp_path):
+    reader = SnapshotStore(tmp_path)
+    writer = SnapshotStore(tmp_path, max_bytes=5_000)
+    contents = {}
+
+    def put(index):
+        contents[f"/{index}"] = body(index)
+        writer.put(f"/{index}", 200, contents[f"/{index}"])
+
+    for index in range(2):
+        put(index)
+    # data.bin отображён в память, пока в нём два ответа
+    assert reader.get("/0").content == contents["/0"]
+    for index in range(2, 4):
+        put(index)
+    assert len(reader) == 4
+    inode = os.stat(reader.index_path).st_ino
+    for index in range(4, 6):
+        put(index)
+    assert os.stat(reader.index_path).st_ino != inode
+    # Старая запись индекса указывает за конец отображения, data.bin
+    # отображается заново, и по старому смещению лежит тело другого
+    # ответа: оно распаковывается, но не совпадает по контрольной сумме
+    assert reader.get("/2") is None
+    assert reader.get("/3").content == contents["/3"]
+    assert reader.get("/5").content == contents["/5"]
+
+
+def test_corrupted_body_is_not_returned(tmp_path):
+    store = SnapshotStore(tmp_path)
+    store.put("/a", 200, b"1" * 100)
+    entry = store._index["/a"]
+    store.close()
+    # Другое сжатое тело того же размера
+    other = zlib.compress(b"2" * 100)
+    assert len(other) == entry["size"]
+    with open(store.data_path, "r+b") as file:
+        file.seek(entry["offset"])
+        file.write(other)
+    assert store.get("/a") is None
+
+
+def test_snapshot_key_ignores_api_key_and_city_case():
+    assert snapshot_key("/search", {"q": " New  York", "apikey": "x"}) == (
+        snapshot_key("/search", {"q": "new york"})
+    )
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeClient:
+    limiter = None
+
+    def __init__(self, response=None):
+        self.response = response
+
+    def get(self, path, params=None):
+        if self.response is None:
+            raise UpstreamError("недоступен")
+        return self.response
+
+
+def test_replay_does_not_call_upstream(tmp_path):
+    store = SnapshotStore(tmp_path)
+    SnapshotClient(FakeClient(FakeResponse(200, b"1")), store, "record").get("/a")
+    client = SnapshotClient(FakeClient(), store, "replay")
+    assert client.get("/a").content == b"1"
+    with pytest.raises(UpstreamError):
+        client.get("/b")
+    assert client.stats["hits"] == 1
+    assert client.stats["misses"] == 1
+
+
+def test_fallback_uses_stored_response(tmp_path):
+    store = SnapshotStore(tmp_path)
+    SnapshotClient(FakeClient(FakeResponse(200, b"1")), store, "fallback").get("/a")
+    client = SnapshotClient(FakeClient(), store, "fallback")
+    assert client.get("/a").content == b"1"
+    with pytest.raises(UpstreamError):
+        client.get("/b")
+    assert client.stats["fallbacks"] == 1
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+# AccuWeather недоступен или превышен лимит запросов
+class UpstreamError(Exception):
+    pass
+
+
+# Ограничение частоты запросов: token bucket на запросы в секунду
+# и дневная квота. Если токена нет дольше max_wait, запрос отклоняется
+class RateLimiter:
+    def __init__(self, rate, daily_quota=0, max_wait=2.0):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.daily_quota = daily_quota
+        self.max_wait = max_wait
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.day = None
+        self.used_today = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        wait_until = self._wait_until(deadline)
+        while True:
+            delay = self._take(wait_until)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    # То же для asyncio: ожидание токена не блокирует цикл событий
+    async def acquire_async(self, deadline=None):
+        wait_until = self._wait_until(deadline)
+        while True:
+            delay = self._take(wait_until)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def _wait_until(self, deadline):
+        wait_until = time.monotonic() + self.max_wait
+        if deadline is not None:
+            wait_until = min(wait_until, deadline)
+        return wait_until
+
+    # Попытка взять токен: 0, если он взят, иначе сколько секунд ждать
+    def _take(self, wait_until):
+        with self._lock:
+            delay = self._take_token(time.monotonic())
+        return self._check_delay(delay, wait_until)
+
+    def _take_token(self, now):
+        self._use_daily_quota()
+        if self.rate:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.used_today += 1
+        return 0
+
+    def _check_delay(self, delay, wait_until):
+        if delay and time.monotonic() + delay > wait_until:
+            metrics.inc("upstream_rejected_total")
+            raise UpstreamError("Превышено ограничение частоты запросов к AccuWeather")
+        return delay
+
+    def _use_daily_quota(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+        if self.daily_quota and self.used_today >= self.daily_quota:
+            metrics.inc("upstream_rejected_total")
+            raise UpstreamError("Исчерпана дневная квота запросов к AccuWeather")
+
+
+# RateLimiter с общим для всех процессов сервера состоянием: токены
+# и счётчик дневной квоты хранятся в SQLite (файл path, строка name
+# таблицы rate_limits), поэтому лимиты не умножаются на число процессов
+class SharedRateLimiter(RateLimiter):
+    def __init__(self, path, name, rate, daily_quota=0, max_wait=2.0):
+        super().__init__(rate, daily_quota, max_wait)
+        self.name = name
+        self._conn = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, "
+            "day TEXT, used_today INTEGER NOT NULL)"
+        )
+
+    # Время - по системным часам, общим для всех процессов
+    def _take(self, wait_until):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._load()
+                delay = self._take_token(time.time())
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits "
+                    "(name, tokens, updated, day, used_today) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        self.name,
+                        self.tokens,
+                        self.updated,
+                        self.day.isoformat(),
+                        self.used_today,
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._check_delay(delay, wait_until)
+
+    # Запрос к SQLite может ждать блокировку, поэтому не в цикле событий
+    async def acquire_async(self, deadline=None):
+        wait_until = self._wait_until(deadline)
+        while True:
+            delay = await asyncio.to_thread(self._take, wait_until)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def _load(self):
+        row = self._conn.execute(
+            "SELECT tokens, updated, day, used_today FROM rate_limits WHERE name = ?",
+            (self.name,),
+        ).fetchone()
+        if row is None:
+            self.tokens, self.updated = self.capacity, time.time()
+            self.day, self.used_today = None, 0
+            return
+        self.tokens, self.updated, day, self.used_today = row
+        self.day = date.fromisoformat(day) if day else None
+
+
+def _observe(endpoint, status, started):
+    metrics.inc("upstream_requests_total", endpoint=endpoint, status=status)
+    metrics.observe(
+        "upstream_request_seconds", time.perf_counter() - started, endpoint=endpoint
+    )
+
+
+# Общий HTTP-клиент для AccuWeather: пул keep-alive соединений,
+# таймаут на каждый запрос и общий срок, повторы с джиттером при 5xx
+# и таймаутах, ограничение частоты запросов
+class UpstreamClient:
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        limiter=None,
+        timeout=5.0,
+        deadline=15.0,
+        retries=2,
+        backoff=0.3,
+        pool_size=20,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.limiter = limiter
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # GET-запрос к AccuWeather. Ответы 4xx возвращаются как есть,
+    # при недоступности сервиса выбрасывается UpstreamError
+    def get(self, path, params=None):
+        params = dict(params or {}, apikey=self.api_key)
+        endpoint = path.split("/")[1]
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire(deadline)
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise UpstreamError("AccuWeather не ответил вовремя")
+            started = time.perf_counter()
+            status = "error"
+            try:
+                response = self.session.get(
+                    self.base_url + path,
+                    params=params,
+                    timeout=min(self.timeout, left),
+                )
+                status = str(response.status_code)
+                if response.status_code < 500:
+                    return response
+                error = UpstreamError(
+                    f"AccuWeather вернул ошибку {response.status_code}"
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = UpstreamError(f"AccuWeather недоступен: {exc}")
+            finally:
+                _observe(endpoint, status, started)
+
+            attempt += 1
+            delay = random.uniform(0, self.backoff * 2**attempt)
+            if attempt > self.retries or time.monotonic() + delay >= deadline:
+                raise error
+            time.sleep(delay)
+
+
+# Ответ AccuWeather, полностью прочитанный асинхронным клиентом
+class UpstreamResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Асинхронный клиент AccuWeather на aiohttp с теми же таймаутами,
+# повторами и ограничением частоты, что и UpstreamClient. Сессия
+# создаётся в start() и закрывается в close() внутри цикла событий
+class AsyncUpstreamClient:
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        limiter=None,
+        timeout=5.0,
+        deadline=15.0,
+        retries=2,
+        backoff=0.3,
+        pool_size=100,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.limiter = limiter
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size)
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get(self, path, params=None):
+        params = dict(params or {}, apikey=self.api_key)
+        endpoint = path.split("/")[1]
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if self.limiter:
+                await self.limiter.acquire_async(deadline)
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise UpstreamError("AccuWeather не ответил вовремя")
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self.session.get(
+                    self.base_url + path,
+                    params=params,
+                    timeout=aiohttp.ClientTimeout(total=min(self.timeout, left)),
+                ) as response:
+                    content = await response.read()
+                status = str(response.status)
+                if response.status < 500:
+                    return UpstreamResponse(response.status, content)
+                error = UpstreamError(f"AccuWeather вернул ошибку {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = UpstreamError(f"AccuWeather недоступен: {exc}")
+            finally:
+                _observe(endpoint, status, started)
+
+            attempt += 1
+            delay = random.uniform(0, self.backoff * 2**attempt)
+            if attempt > self.retries or time.monotonic() + delay >= deadline:
+                raise error
+            await asyncio.sleep(delay)